@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+awrstrip_bench.py - Micro-benchmark for modules/awrstrip.py
+Copyright (c) 2024 - Bart Sjerps <bart@dirty-cache.com>
+License: GPLv3+
+
+Generates a synthetic corpus of AWR HTML reports (single instance and RAC, various sizes)
+with the structure of real reports: statistics tables, top SQL tables, the complete list
+of SQL text and an ADDM section. Each report is stripped with each available etree backend
+(lxml and the xml.etree fallback) in a separate process, measuring parse, strip and write
+time and peak memory (RSS).
+
+contrib/benchmark/awrstrip_bench.py
+contrib/benchmark/awrstrip_bench.py --sizes 1,5 --runs 3 --json > results.jsonl
+"""
+
+import os, sys, json, time, random, shutil, tempfile, argparse, platform, resource
+from subprocess import check_output
+from xml.sax.saxutils import escape
+
+benchdir = os.path.dirname(os.path.abspath(__file__))
+srcdir   = os.path.join(os.path.dirname(os.path.dirname(benchdir)), 'src', 'dbcollect')
+
+MB = 1048576
+
+words  = ['orders', 'order_lines', 'customers', 'products', 'stock', 'invoices', 'payments', 'accounts', 'audit_log', 'sessions']
+cols   = ['id', 'status', 'amount', 'created', 'updated', 'owner_id', 'qty', 'price', 'descr', 'region']
+stats  = ['DB time(s)', 'DB CPU(s)', 'Redo size (bytes)', 'Logical read (blocks)', 'Block changes', 'Physical read (blocks)',
+          'Physical write (blocks)', 'Read IO requests', 'Write IO requests', 'User calls', 'Parses (SQL)', 'Hard parses (SQL)',
+          'Executes (SQL)', 'Rollbacks', 'Transactions', 'log file sync', 'db file sequential read', 'direct path read']
+
+def number(rnd):
+    return '{0:,.2f}'.format(rnd.random() * 10 ** rnd.randint(1, 7))
+
+def sql_id(rnd):
+    return ''.join([rnd.choice('0123456789abcdfghjkmnpqrstuvwxyz') for _ in range(13)])
+
+def sql_text(rnd):
+    table, col = rnd.choice(words), rnd.choice(cols)
+    stmt = rnd.choice([
+        'SELECT {1}, COUNT(*) FROM {0} WHERE {1} > :b1 AND status <> \'X\' GROUP BY {1}',
+        'UPDATE {0} SET {1} = :b1 WHERE id = :b2 AND {1} < :b3',
+        'INSERT INTO {0} ({1}, created) VALUES (:b1, SYSDATE)',
+        'DELETE FROM {0} WHERE created < SYSDATE - 30 AND {1} IS NULL',
+        'SELECT /*+ INDEX({0} {0}_IX1) */ * FROM {0} t, customers c WHERE t.owner_id = c.id AND c.region = :b1',
+    ]).format(table, col)
+    # Long statements are common in AWR reports
+    return stmt + ''.join([' AND {0}.{1} = :b{2}'.format(table, rnd.choice(cols), n) for n in range(rnd.randint(0, 40))])
+
+def table(summary, heading, rows):
+    out = ['<table border="0" width="600" class="tdiff" summary="{0}">\n<tr>'.format(summary)]
+    out += ['<th class="awrbg" scope="col">{0}</th>'.format(h) for h in heading]
+    out.append('</tr>\n')
+    for n, row in enumerate(rows):
+        cls = 'awrc' if n % 2 else 'awrnc'
+        out.append('<tr>' + ''.join(['<td align="right" class="{0}">{1}</td>'.format(cls, c) for c in row]) + '</tr>\n')
+    out.append('</table><p />\n')
+    return ''.join(out)
+
+def generate(path, size, instances, seed=1):
+    """Write a synthetic AWR report of about size bytes (instances > 1 is a RAC global report)"""
+    rnd   = random.Random(seed)
+    insts = range(1, instances + 1)
+    with open(path, 'w') as f:
+        written = [0]
+        def write(s):
+            f.write(s)
+            written[0] += len(s)
+        kind = 'RAC ' if instances > 1 else ''
+        write('<html lang="en"><head><title>AWR {0}Report for DB: BENCH, Snaps: 100-101</title>\n'.format(kind))
+        write('<style type="text/css">body.awr {font:bold 10pt Arial,Helvetica,Geneva,sans-serif;color:black;}</style></head>\n')
+        write('<body class="awr">\n<h1 class="awr">WORKLOAD REPOSITORY {0}report for</h1>\n'.format(kind))
+        write(table('This table displays database instance information', ['DB Name', 'DB Id', 'Instance', 'Inst num', 'Release', 'RAC'],
+                    [['BENCH', '1234567890', 'bench{0}'.format(i), i, '19.0.0.0.0', 'YES' if instances > 1 else 'NO'] for i in insts]))
+
+        # Statistics (about 45% of the report)
+        while written[0] < size * 0.45:
+            rows = []
+            for stat in stats:
+                for i in insts:
+                    rows.append([stat, i] + [number(rnd) for _ in range(6)])
+            write('<h3 class="awr">Load Profile</h3>\n')
+            write(table('This table displays load profile', ['Statistic', 'Inst', 'Per Second', 'Per Transaction', 'Per Exec', 'Per Call', 'Total', 'Avg'], rows))
+
+        # Top SQL (about 20%)
+        ids = []
+        while written[0] < size * 0.65:
+            rows = []
+            for _ in range(25):
+                ids.append(sql_id(rnd))
+                rows.append([number(rnd), number(rnd), rnd.randint(1, 99999), rnd.choice(list(insts)), '<a class="awr" href="#{0}">{0}</a>'.format(ids[-1]),
+                             'SQL*Plus', escape(sql_text(rnd)[:50])])
+            write('<h3 class="awr">SQL ordered by Elapsed Time</h3>\n')
+            write(table('This table displays top SQL by elapsed time', ['Elapsed Time (s)', 'CPU Time (s)', 'Executions', 'Inst', 'SQL Id', 'SQL Module', 'SQL Text'], rows))
+
+        # Complete list of SQL text (about 25%)
+        write('<h3 class="awr">Complete List of SQL Text</h3>\n')
+        rows, pending = [], 0
+        while written[0] + pending < size * 0.9:
+            rows.append(['<a class="awr" name="{0}"></a>{0}'.format(ids[len(rows) % len(ids)] if ids else sql_id(rnd)), escape(sql_text(rnd))])
+            pending += len(rows[-1][1]) + 120
+        write(table('This table displays the text of the SQL statements which have been referred to in the report', ['SQL Id', 'SQL Text'], rows))
+
+        # ADDM (rest)
+        lines = ['          ADDM Report for Task \'TASK_12345\'\n', '          -----------------------------------\n\n']
+        n, pending = 1, 0
+        while written[0] + pending < size:
+            lines.append('Finding {0}: Top SQL Statements\nImpact is {1} active sessions, {2}% of total activity.\n'.format(n, number(rnd), rnd.randint(1, 99)))
+            lines.append('   Run SQL Tuning Advisor on the SELECT statement with SQL_ID "{0}".\n   {1}\n\n'.format(sql_id(rnd), escape(sql_text(rnd))))
+            pending += len(lines[-2]) + len(lines[-1])
+            n += 1
+        write('<pre class="awr">\n' + ''.join(lines) + '</pre>\n')
+        write('<p />\nEnd of Report\n</body></html>\n')
+
+def get_etree(backend):
+    if backend == 'lxml':
+        from lxml import etree
+    else:
+        from xml.etree import ElementTree as etree
+    return etree
+
+def backends():
+    """Return the available backends"""
+    result = []
+    try:
+        get_etree('lxml')
+        result.append('lxml')
+    except ImportError:
+        pass
+    result.append('etree')
+    return result
+
+def rss():
+    """Current RSS in bytes"""
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+def child(backend, path, outdir):
+    """Strip one report with the given backend, print the results as JSON"""
+    sys.dont_write_bytecode = True
+    sys.path.insert(0, srcdir)
+    etree = get_etree(backend)
+    from modules import awrstrip
+    base = rss()
+    t0   = time.time()
+    tree = etree.parse(path)
+    t1   = time.time()
+    changed = awrstrip.strip_tree(tree)
+    t2   = time.time()
+    out  = os.path.join(outdir, '{0}_{1}'.format(backend, os.path.basename(path)))
+    tree.write(out, encoding='utf-8')
+    t3   = time.time()
+    with open(out) as f:
+        removed = f.read().count(awrstrip._deleted)
+    result = {
+        'parse':    round(t1 - t0, 3),
+        'strip':    round(t2 - t1, 3),
+        'write':    round(t3 - t2, 3),
+        'peak_mem': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - base,
+        'removed':  removed if changed else 0,
+        'out_size': os.path.getsize(out),
+    }
+    os.unlink(out)
+    print(json.dumps(result))
+
+def main():
+    parser = argparse.ArgumentParser(usage='awrstrip_bench.py [options]')
+    parser.add_argument('--sizes',     type=str, default='1,10,50', help='Report sizes in MiB (comma separated, default 1,10,50)')
+    parser.add_argument('--rac',       type=int, default=4,         help='Number of instances for the RAC reports (default 4, 0=no RAC reports)')
+    parser.add_argument('--backend',   type=str, choices=('lxml', 'etree'), help='Only test this backend')
+    parser.add_argument('--runs',      type=int, default=1,         help='Runs per report and backend (default 1)')
+    parser.add_argument('--corpus',    type=str,                    help='Directory for the corpus, kept for the next run (default: temporary)')
+    parser.add_argument('--json',      action='store_true',         help='Print results as JSON lines')
+    parser.add_argument('--child',     nargs=3,                     help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        return
+
+    corpus = args.corpus or tempfile.mkdtemp(prefix='awrstrip_bench_')
+    if not os.path.isdir(corpus):
+        os.makedirs(corpus)
+    try:
+        reports = []
+        for size in [int(s) for s in args.sizes.split(',')]:
+            for instances in ([1, args.rac] if args.rac > 1 else [1]):
+                name = 'awr_{0}_{1}mb.html'.format('rac{0}'.format(instances) if instances > 1 else 'single', size)
+                path = os.path.join(corpus, name)
+                if not os.path.isfile(path):
+                    generate(path, size * MB, instances)
+                reports.append((name, path))
+
+        info = {'python': platform.python_version()}
+        try:
+            from lxml import etree
+            info['lxml'] = '.'.join([str(x) for x in etree.LXML_VERSION])
+        except ImportError:
+            pass
+
+        if not args.json:
+            print('{0:<7} {1:<24} {2:>8} {3:>8} {4:>8} {5:>8} {6:>8} {7:>10} {8:>8}'.format(
+                'backend', 'report', 'size(MB)', 'parse(s)', 'strip(s)', 'write(s)', 'MB/s', 'peak(MB)', 'removed'))
+        for backend in [args.backend] if args.backend else backends():
+            for name, path in reports:
+                for run in range(args.runs):
+                    out = check_output([sys.executable, os.path.abspath(__file__), '--child', backend, path, corpus])
+                    result = json.loads(out.decode('utf-8'))
+                    size   = os.path.getsize(path)
+                    total  = result['parse'] + result['strip'] + result['write']
+                    result.update(info)
+                    result.update({'backend': backend, 'report': name, 'size': size, 'run': run + 1,
+                                   'total': round(total, 3), 'mb_s': round(size / float(MB) / total, 2) if total else None})
+                    if args.json:
+                        print(json.dumps(result, sort_keys=True))
+                    else:
+                        print('{0:<7} {1:<24} {2:>8.1f} {3:>8.3f} {4:>8.3f} {5:>8.3f} {6:>8.2f} {7:>10.1f} {8:>8}'.format(
+                            backend, name, size / float(MB), result['parse'], result['strip'], result['write'],
+                            result['mb_s'] or 0, result['peak_mem'] / float(MB), result['removed']))
+                    sys.stdout.flush()
+    finally:
+        if not args.corpus:
+            shutil.rmtree(corpus, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+bench.py - End-to-end benchmark for dbcollect with a fake Oracle environment
+Copyright (c) 2024 - Bart Sjerps <bart@dirty-cache.com>
+License: GPLv3+
+
+Creates a fake ORACLE_HOME with a stub bin/sqlplus (see sqlplus in this directory),
+opatch and lsnrctl, starts fake ora_pmon_<sid> processes and runs dbcollect end to end
+with --orahome, --no-oratab and --no-orainv. Reports wall time, reports/s, peak RSS and
+archive size for each run, so throughput changes can be compared on any Linux box.
+
+Run as a normal (non-root) user, for example:
+
+contrib/benchmark/bench.py --instances 2 --days 3 --latency 0.1 --runs 3
+contrib/benchmark/bench.py --json -- --strip
+"""
+
+import os, sys, json, time, shutil, tempfile, argparse, resource, zipfile
+from subprocess import Popen, PIPE, DEVNULL, check_call
+
+benchdir = os.path.dirname(os.path.abspath(__file__))
+gitdir   = os.path.dirname(os.path.dirname(benchdir))
+
+def build(workdir):
+    """Build a dbcollect zipapp from the source tree"""
+    srcdir = os.path.join(workdir, 'src')
+    shutil.copytree(os.path.join(gitdir, 'src', 'dbcollect'), srcdir, ignore=shutil.ignore_patterns('__pycache__', '*.pyc'))
+    with open(os.path.join(srcdir, 'lib', 'buildinfo.py'), 'w') as f:
+        f.write('buildinfo = {"builddate": "benchmark", "buildhash": "benchmark"}\n')
+    target = os.path.join(workdir, 'dbcollect')
+    check_call([sys.executable, '-m', 'zipapp', '--output', target, '--main', 'dbcollect:main', srcdir])
+    return target
+
+def make_orahome(workdir, args):
+    """Create the fake ORACLE_HOME"""
+    orahome = os.path.join(workdir, 'orahome')
+    os.makedirs(os.path.join(orahome, 'bin'))
+    os.makedirs(os.path.join(orahome, 'OPatch'))
+    with open(os.path.join(benchdir, 'sqlplus')) as f:
+        stub = f.read().split('\n', 1)[1]
+    scripts = {
+        'bin/sqlplus':   '#!{0}\n{1}'.format(sys.executable, stub),
+        'bin/lsnrctl':   '#!/bin/sh\necho "LSNRCTL for Linux: Version 19.0.0.0.0 - Production"\necho "The command completed successfully"\n',
+        'OPatch/opatch': '#!/bin/sh\necho "12345678;Database Release Update : 19.0.0.0.0 (12345678)"\necho "OPatch succeeded."\n',
+    }
+    for name, content in scripts.items():
+        path = os.path.join(orahome, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        os.chmod(path, 0o755)
+    config = {
+        'latency':        args.latency,
+        'dbinfo_latency': args.dbinfo_latency,
+        'reportsize':     args.reportsize * 1024,
+        'rac':            args.rac,
+        'interval':       args.interval,
+        'cpus':           args.cpus,
+    }
+    with open(os.path.join(orahome, 'bench.json'), 'w') as f:
+        json.dump(config, f)
+    # dbcollect may switch to another user when started as root
+    for path in (workdir, orahome):
+        os.chmod(path, 0o755)
+    return orahome
+
+def start_pmons(sids):
+    """Start a fake pmon process for each SID (cat waiting on stdin, shown as ora_pmon_<sid> by ps)"""
+    return [Popen(['ora_pmon_{0}'.format(sid)], executable='/bin/cat', stdin=PIPE, stdout=DEVNULL) for sid in sids]
+
+def archive_stats(path):
+    """Return (number of reports, peak total RSS from monitor.jsonl) for the dbcollect ZIP file"""
+    reports, peak_rss = 0, None
+    with zipfile.ZipFile(path) as zf:
+        for name in zf.namelist():
+            parts = name.split('/')
+            if len(parts) == 4 and parts[1] == 'oracle' and parts[2] != 'dbinfo' and parts[3].endswith(('.html', '.txt')):
+                reports += 1
+            elif name.endswith('/monitor.jsonl'):
+                samples  = [json.loads(l) for l in zf.read(name).decode('utf-8').splitlines()]
+                peak_rss = max([s['rss'] for s in samples]) if samples else None
+    return reports, peak_rss
+
+def run(n, dbcollect, orahome, sids, args):
+    """Run dbcollect once and return the results"""
+    zippath = os.path.join('/tmp', 'dbcollect-bench-{0}.zip'.format(os.getpid()))
+    cmd = [sys.executable, dbcollect, '-o', '-q', '--filename', zippath,
+           '--orahome', orahome, '--no-oratab', '--no-orainv', '--include', ','.join(sids),
+           '--days', str(args.days)]
+    if args.tasks is not None:
+        cmd += ['--tasks', str(args.tasks)]
+    if not args.with_sys:
+        cmd.append('--no-sys')
+    cmd += args.extra
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start  = time.time()
+    proc   = Popen(cmd, stdout=DEVNULL, stderr=DEVNULL, cwd='/tmp')
+    rc     = proc.wait()
+    wall   = time.time() - start
+    after  = resource.getrusage(resource.RUSAGE_CHILDREN)
+    if not os.path.isfile(zippath):
+        sys.exit('Run {0}: dbcollect failed (rc={1}), no ZIP file {2}'.format(n, rc, zippath))
+    reports, peak_rss = archive_stats(zippath)
+    result = {
+        'run':          n,
+        'rc':           rc,
+        'wall':         round(wall, 2),
+        'cpu':          round(after.ru_utime + after.ru_stime - before.ru_utime - before.ru_stime, 2),
+        'reports':      reports,
+        'reports_s':    round(reports / wall, 2),
+        'max_rss':      after.ru_maxrss * 1024,     # Largest single process (bytes)
+        'peak_rss':     peak_rss,                   # All dbcollect processes (monitor.jsonl)
+        'archive_size': os.path.getsize(zippath),
+    }
+    if args.keep:
+        result['archive'] = zippath
+    else:
+        os.unlink(zippath)
+    return result
+
+def report(results, args):
+    if args.json:
+        for result in results:
+            print(json.dumps(result, sort_keys=True))
+        return
+    mb = 1048576.0
+    print('{0:>4} {1:>8} {2:>8} {3:>8} {4:>10} {5:>11} {6:>12} {7:>12}'.format(
+        'run', 'wall(s)', 'cpu(s)', 'reports', 'reports/s', 'maxrss(MB)', 'peakrss(MB)', 'archive(MB)'))
+    for r in results:
+        print('{0:>4} {1:>8.2f} {2:>8.2f} {3:>8} {4:>10.2f} {5:>11.1f} {6:>12} {7:>12.1f}'.format(
+            r['run'], r['wall'], r['cpu'], r['reports'], r['reports_s'], r['max_rss'] / mb,
+            '{0:.1f}'.format(r['peak_rss'] / mb) if r['peak_rss'] else '-', r['archive_size'] / mb))
+    if len(results) > 1:
+        walls = sorted([r['wall'] for r in results])
+        print('median wall time {0:.2f}s, best {1:.2f}s'.format(walls[len(walls) // 2], walls[0]))
+
+def main():
+    parser = argparse.ArgumentParser(usage='bench.py [options] [-- dbcollect options]')
+    parser.add_argument('--dbcollect',      type=str,                    help='dbcollect zipapp to test (default: build from this source tree)')
+    parser.add_argument('--instances',      type=int,   default=1,       help='Number of fake instances (default 1)')
+    parser.add_argument('--rac',            type=int,   default=1,       help='RAC instances in the AWR repository (default 1)')
+    parser.add_argument('--days',           type=int,   default=2,       help='Days of AWR reports (default 2)')
+    parser.add_argument('--interval',       type=int,   default=60,      help='AWR snapshot interval in minutes (default 60)')
+    parser.add_argument('--cpus',           type=int,   default=8,       help='NUM_CPUS of the fake instances (default 8)')
+    parser.add_argument('--tasks',          type=int,                    help='dbcollect --tasks')
+    parser.add_argument('--latency',        type=float, default=0.2,     help='Seconds per AWR report (default 0.2)')
+    parser.add_argument('--dbinfo-latency', type=float, default=0.05,    help='Seconds per dbinfo script (default 0.05)')
+    parser.add_argument('--reportsize',     type=int,   default=1024,    help='AWR report size in KiB (default 1024)')
+    parser.add_argument('--runs',           type=int,   default=1,       help='Number of runs (default 1)')
+    parser.add_argument('--with-sys',       action='store_true',         help='Include OS collection (default --no-sys)')
+    parser.add_argument('--keep',           action='store_true',         help='Keep the ZIP file of the last run')
+    parser.add_argument('--json',           action='store_true',         help='Print results as JSON lines')
+    parser.add_argument('extra',            nargs='*',                   help='Extra dbcollect options (after --)')
+    args = parser.parse_args()
+
+    if os.getuid() == 0:
+        sys.exit('Run the benchmark as a normal user, dbcollect switches users when started as root')
+
+    workdir = tempfile.mkdtemp(prefix='dbcollect_bench_')
+    sids    = ['BENCH{0}'.format(n + 1) for n in range(args.instances)]
+    pmons   = []
+    try:
+        dbcollect = args.dbcollect or build(workdir)
+        orahome   = make_orahome(workdir, args)
+        pmons     = start_pmons(sids)
+        results   = []
+        for n in range(args.runs):
+            results.append(run(n + 1, dbcollect, orahome, sids, args))
+        report(results, args)
+    finally:
+        for pmon in pmons:
+            pmon.stdin.close()
+            pmon.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
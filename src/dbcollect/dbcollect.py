@@ -20,14 +20,22 @@ elif sys.version_info[0] == 3 and sys.version_info[1] < 6:
 
 from lib.config import versioninfo, settings
 from lib.log import logsetup
-from lib.errors import Errors, CustomException, ErrorHelp
+from lib.errors import Errors, CustomException, ErrorHelp, ZipCreateError
 from lib.archive import Archive
+from lib.taskpool import BackgroundTask
+from lib.trace import Span, trace_setup, trace_close
+from lib.profiler import profile_setup, profile_merge
+from lib.metrics import metrics_setup, metric_set, metrics_write
+from lib.monitor import monitor_start
+from lib.replay import record_setup, record_close, replay_setup
 from lib.user import switchuser, username, dbuser
 from lib.jsonfile import JSONFile, buildinfo
 from lib.functions import sudosetup, getfile
 from modules.oracle import oracle_info
 from modules.syscollect import host_info
 from modules.updater import update
+from modules.multiuser import multi_collect
+from modules.merge import merge
 
 def printversion():
     """Show version information"""
@@ -38,6 +46,24 @@ def printversion():
     print ('Builddate: {0}'.format(buildinfo['builddate']))
     print ('Buildhash: {0}'.format(buildinfo['buildhash']))
 
+def cmdargs(parser, args, skip=()):
+    """Rebuild the command line options from the parsed args (non-default values), without the skip options"""
+    cmdline = []
+    for action in parser._actions:
+        if not action.option_strings or action.dest in skip or action.dest == 'help':
+            continue
+        value = getattr(args, action.dest)
+        if value is None or value == action.default:
+            continue
+        option = action.option_strings[-1]
+        if action.nargs == 0:
+            cmdline.append(option)
+        elif isinstance(value, list):
+            cmdline += [option] + value
+        else:
+            cmdline += [option, str(value)]
+    return cmdline
+
 def main():
     parser = argparse.ArgumentParser(usage='dbcollect [options]')
     parser.add_argument("-V", "--version",    action="store_true",        help="Version and copyright info")
@@ -48,8 +74,10 @@ def main():
     parser.add_argument(      "--update",     action="store_true",        help="Check for updates")
     parser.add_argument(      "--sudoers",    action="store_true",        help="Install sudoers file")
     parser.add_argument(      "--filename",   type=str,                   help="output filename, default dbcollect-<hostname>.zip")
+    parser.add_argument(      "--split-size", type=int,                   help="Split the zip file in parts of about <size> MiB (<filename>.partN.zip)", metavar='<size>')
     parser.add_argument(      "--tempdir",    type=str, default='/tmp',   help="TEMP directory, default /tmp")
     parser.add_argument("-u", "--user",       type=str,                   help="Switch to user (if run as root)")
+    parser.add_argument(      "--multi-user", action="store_true",        help="Run for all Oracle users concurrently and merge into one zip file (if run as root)")
     parser.add_argument("-d", "--days",       type=int, default=10,       help="Number of days ago to START collect of AWR data (default 10, max 999)")
     parser.add_argument(      "--end_days",   type=int, default=0,        help="Number of days ago to END AWR collect period, default 0, max 999")
     parser.add_argument(      "--logons",     type=str,                   help="Use logons file", metavar='<file>')
@@ -59,21 +87,41 @@ def main():
     parser.add_argument(      "--ignore-awr", action="store_true",        help="Ignore AWR reports for databases that have no previous usage")
     parser.add_argument(      "--strip",      action="store_true",        help="Strip SQL sections from AWR reports")
     parser.add_argument(      "--no-rac",     action="store_true",        help="Generate AWRs for local instance only")
+    parser.add_argument(      "--rac-partition", action="store_true",    help="Generate AWRs only for this node's share of RAC instances (run on all nodes)")
     parser.add_argument(      "--no-stby",    action="store_true",        help="Generate AWRs for primary DB only (ignore standby DB)")
     parser.add_argument(      "--no-awr",     action="store_true",        help="Skip AWR reports")
     parser.add_argument(      "--no-sar",     action="store_true",        help="Skip SAR reports")
+    parser.add_argument(      "--sar-format", type=str, default='binary', choices=('binary','csv','both'), help="Linux SAR files as binary (default), CSV (sadf -d) or both")
     parser.add_argument(      "--no-ora",     action="store_true",        help="Skip Oracle collection")
     parser.add_argument(      "--no-sys",     action="store_true",        help="Skip OS collection")
     parser.add_argument(      "--no-orainv",  action="store_true",        help="Ignore ORACLE_HOMES from Oracle Inventory")
     parser.add_argument(      "--no-oratab",  action="store_true",        help="Ignore ORACLE_HOMES from oratab")
+    parser.add_argument(      "--no-monitor", action="store_true",        help="Don't monitor the resource usage of dbcollect itself")
     parser.add_argument(      "--no-timeout", action="store_true",        help="Don't abort on SQL*Plus timeout when detecting instances")
     parser.add_argument(      "--nmon",       type=str,                   help="Where to look for NMON files (comma separated)", metavar='PATH')
     parser.add_argument(      "--include",    type=str,                   help="Include Oracle instances (comma separated)", metavar='INSTANCES')
     parser.add_argument(      "--exclude",    type=str,                   help="Exclude Oracle instances (comma separated)", metavar='INSTANCES')
     parser.add_argument(      "--tasks",      type=int,                   help="Max number of tasks (default 50%% of cpus (up to 8), 0=use all cpus)")
     parser.add_argument(      "--timeout",    type=int, default=10,       help="Timeout (minutes) for SQL statements (default 10)")
+    parser.add_argument(      "--cmd-timeout", type=int, default=120,     help="Timeout (seconds) for OS commands (default 120, 0=no timeout)")
+    parser.add_argument(      "--os-timeout", type=int, default=30,       help="Time budget (minutes) for OS collection (default 30, 0=no limit)")
+    parser.add_argument(      "--dbinfo-format", type=str, default='text', choices=('text','csv'), help="Output format for dbinfo scripts: text (default) or csv (SQL*Plus 12.2+)")
+    parser.add_argument(      "--backend",    type=str, default='sqlplus', choices=('sqlplus','driver','fake'), help="Query backend: sqlplus (default), driver (python-oracledb/cx_Oracle) or fake (testing only)")
+    parser.add_argument(      "--profile",    action="store_true",        help="Profile dbcollect itself (cProfile), statistics are stored in the ZIP file")
+    parser.add_argument(      "--metrics",    type=str,                   help="Write run metrics in Prometheus format (node_exporter textfile collector)", metavar='<file>')
+    parser.add_argument(      "--record",     type=str,                   help="Record all command, file and database interactions to a file for --replay", metavar='<file>')
+    parser.add_argument(      "--replay",     type=str,                   help="Replay a recording instead of running commands and queries (testing only)", metavar='<file>')
+    parser.add_argument(      "--merge",      type=str, nargs='+',        help="Merge dbcollect ZIP files of the same host into one (--filename), without recompression", metavar='<zipfile>')
     parser.add_argument(      "--error",      type=str,                   help="Get info on error, warning or informational message (i.e., E001)", metavar='<error>')
+    parser.add_argument(      "--logfile",    type=str,                   help=argparse.SUPPRESS)
+    parser.add_argument(      "--task-slots", type=str,                   help=argparse.SUPPRESS)
     args = parser.parse_args()
+    if args.record and args.replay:
+        parser.error('--record and --replay cannot be used together')
+    if args.multi_user:
+        for option in ('user', 'record', 'replay', 'metrics'):
+            if getattr(args, option):
+                parser.error('--{0} cannot be used with --multi-user'.format(option))
 
     if args.update:
         update(versioninfo['version'])
@@ -84,10 +132,21 @@ def main():
     if args.error:
         ErrorHelp.help(args.error)
         return
+    split_size = args.split_size * 1048576 if args.split_size else None
+    if args.merge:
+        sys.exit(merge(args.merge, args.filename, args.overwrite, split_size))
+    if args.filename:
+        if not args.filename.endswith('.zip'):
+            args.filename += '.zip'
+        zippath = os.path.join('/tmp', args.filename)
+    else:
+        zippath = (os.path.join('/tmp', 'dbcollect-{0}.zip'.format(platform.uname()[1])))
     if os.getuid() == 0:
-        cmdline = sys.argv[1:]
-        cmdline.insert(0, os.path.realpath(sys.argv[0]))
-        if args.user:
+        cmdline = [os.path.realpath(sys.argv[0])] + sys.argv[1:]
+        if args.multi_user and not args.no_ora:
+            cmdline = [os.path.realpath(sys.argv[0])] + cmdargs(parser, args, skip=('multi_user',))
+            sys.exit(multi_collect(args, cmdline, zippath, split_size))
+        elif args.user:
             switchuser(args.user, cmdline)
         else:
             user = dbuser()
@@ -101,37 +160,50 @@ def main():
         return
     if args.quiet:
         sys.stdout = open('/dev/null','w')
-    if args.filename:
-        if not args.filename.endswith('.zip'):
-            args.filename += '.zip'
-        zippath = os.path.join('/tmp', args.filename)
-    else:
-        zippath = (os.path.join('/tmp', 'dbcollect-{0}.zip'.format(platform.uname()[1])))
-    logpath = settings['logpath']
+    logpath = args.logfile or settings['logpath']
     try:
         logsetup(args, logpath)
     except Exception as e:
         logging.fatal(Errors.E014, logpath, e)
         sys.exit(15)
 
+    monitor = None
     try:
         logging.info('For diagnosing errors, use --error option. More info on https://wiki.dirty-cache.com/DBCollect/Troubleshooting')
-        archive = Archive(zippath, args.overwrite)
+        trace_setup()
+        if args.profile:
+            profile_setup()
+        if args.metrics:
+            metrics_setup(args.metrics, version=versioninfo['version'])
+        if args.record:
+            record_setup()
+        elif args.replay:
+            replay_setup(args.replay)
+        archive = Archive(zippath, args.overwrite, split_size=split_size)
         osname = getfile('/etc/system-release') or 'Unknown'
         logging.info('dbcollect {0} - database and system info collector'.format(versioninfo['version']))
         logging.info('Python version {0}'.format(platform.python_version()))
         logging.info('OS version is {0}'.format(osname.strip()))
         logging.info('Current user is {0}'.format(username()))
-        logging.info('Zip file is {0}'.format(zippath))
+        logging.info('Zip file is {0}'.format(zippath if not split_size else archive.path))
         logging.info('Command line is {0}'.format(' '.join(sys.argv)))
+        if not args.no_monitor:
+            monitor = monitor_start(settings['monitor_interval'])
         metainfo = JSONFile()
         metainfo.meta()
-        archive.writestr('meta.json', metainfo.dump())
+        archive.writestr('meta.json', metainfo.dump(), allparts=True)
+        # OS and Oracle collection are independent, run OS collection in the background
+        hostinfo = None
         if not args.no_sys:
-            host_info(archive, args)
+            hostinfo = BackgroundTask(host_info, archive, args)
         if not args.no_ora:
-            oracle_info(archive, args)
+            with Span('oracle'):
+                oracle_info(archive, args)
+        if hostinfo:
+            hostinfo.wait()
         archive.ok = True
+        if split_size:
+            zippath = zippath.replace('.zip', '.part*.zip')
         logging.info('Zip file {0} is created succesfully.'.format(zippath))
         logging.info('Do not modify the {0} zipfile before transferring'.format(zippath))
         logging.info('Upload the unmodified file to https://cloud.sjerps.eu/s/dbcollect or send via an alternative method')
@@ -162,11 +234,41 @@ def main():
             with open(logpath) as logfile:
                 print("\nLogfile {0}:".format(logpath))
                 print(logfile.read())
+        if args.record:
+            try:
+                record_close(args.record)
+                logging.info('Recording saved as {0}'.format(args.record))
+            except (IOError, OSError) as e:
+                logging.error(Errors.E012, args.record, os.strerror(e.errno))
+        tracepath = trace_close()
+        profile   = profile_merge()
         try:
+            if tracepath:
+                archive.store(tracepath, 'timings.jsonl')
+            if monitor:
+                archive.writestr('monitor.jsonl', monitor.stop())
+                monitor.summary()
+            if profile:
+                archive.store(profile[0], 'profile.pstats')
+                archive.writestr('profile.txt', profile[1])
             archive.store(logpath, 'dbcollect.log')
             os.unlink(logpath)
+            # Close explicitly, a background thread may still hold a reference after an error
+            archive.close()
+            metric_set('dbcollect_run_success', int(archive.ok))
+            metric_set('dbcollect_archive_size_bytes', archive.size)
         except UnboundLocalError:
             pass
+        except ZipCreateError as e:
+            # The archive is incomplete (next part could not be created), keep the logfile
+            logging.error(*e.args)
+            logging.info('Logfile is {0}'.format(logpath))
+        metric_set('dbcollect_run_completed', 1)
+        metrics_write(force=True)
+        if tracepath and os.path.isfile(tracepath):
+            os.unlink(tracepath)
+        if profile and os.path.isfile(profile[0]):
+            os.unlink(profile[0])
 
 if __name__ == "__main__":
     print('dbcollect must run from a ZipApp package, use https://github.com/outrunnl/dbcollect/releases/latest')
@@ -4,8 +4,9 @@ Copyright (c) 2024 - Bart Sjerps <bart@dirty-cache.com>
 License: GPLv3+
 """
 
-import os, logging
-from zipfile import ZipFile, ZIP_DEFLATED
+import os, re, sys, json, glob, time, struct, logging, shutil, tempfile
+from threading import Lock
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED, ZIP64_LIMIT
 
 from lib.config import versioninfo
 from lib.errors import Errors, ZipCreateError
@@ -15,26 +16,121 @@ class Archive():
     A wrapper around zipfile
     Makes sure it always contains the comment which shows the magic string for dbcollect
     Files and strings are prefixed with the hostname to avoid making a mess un unzip
+    Writes are serialized with a lock so OS and Oracle collection can share the archive
+
+    With split_size (bytes), the archive is written as <name>.part1.zip, <name>.part2.zip, ...
+    Before each write, a part that reached split_size is closed (and ready for transfer) and
+    the next part is started, so a part is larger by at most one entry (plus parts.json) and
+    there is no empty last part. Each part is a valid dbcollect ZIP file with part.json
+    and the entries written with allparts (meta.json). The last part contains parts.json,
+    the index of all parts, which is also written as <name>.parts.json.
+    If the next part cannot be created, the error is raised by this and all following writes.
     """
     zip = None
-    def __init__(self, path, overwrite=False):
-        self.ok      = False
-        self.prefix  = os.uname()[1]
-        self.path    = path
-        if os.path.exists(self.path) and not overwrite:
+    def __init__(self, path, overwrite=False, hostname=None, comment=None, split_size=None):
+        self.ok         = False
+        self.prefix     = hostname or os.uname()[1]
+        self.basepath   = path
+        self.path       = path
+        self.lock       = Lock()
+        self.overwrite  = overwrite
+        self.split_size = split_size
+        self.comment    = comment or 'dbcollect version={0} hostname={1}'.format(versioninfo['version'], self.prefix)
+        self.setid      = '{0}-{1}'.format(self.prefix, time.strftime('%Y%m%d-%H%M%S'))
+        self.allparts   = {}
+        self.parts      = []
+        self.files      = []
+        self.merged     = {}
+        self.error      = None
+        if split_size:
+            path  = self.partpath(1)
+            stale = [p for p in glob.glob(path.replace('.part1.zip', '.part*.zip')) if re.search(r'\.part\d+(\.failed)?\.zip$', p)]
+            if stale and not overwrite:
+                raise ZipCreateError(Errors.E020, sorted(stale)[0])
+            # Remove the parts of a previous (larger) set
+            for p in stale:
+                os.unlink(p)
+        self.open(path)
+
+    def __del__(self):
+        self.close()
+
+    def partpath(self, n):
+        return re.sub(r'\.zip$', '', self.basepath) + '.part{0}.zip'.format(n)
+
+    def open(self, path):
+        """Create the zipfile (or the next part), with the lock held for the next parts"""
+        if os.path.exists(path) and not self.overwrite:
             raise ZipCreateError(Errors.E020, path)
         try:
-            self.zip = ZipFile(self.path,'w', ZIP_DEFLATED, allowZip64=True)
-        except OSError as e:
+            self.zip = ZipFile(path,'w', ZIP_DEFLATED, allowZip64=True)
+        except (IOError, OSError) as e:
             raise ZipCreateError(Errors.E003, path)
-        comment = 'dbcollect version={0} hostname={1}'.format(versioninfo['version'], self.prefix)
-        self.zip.comment = comment.encode('utf-8')
+        self.path = path
+        self.zip.comment = self.comment.encode('utf-8')
+        if self.split_size:
+            part = { 'set': self.setid, 'part': len(self.parts) + 1, 'filename': os.path.basename(path) }
+            self.zip.writestr(os.path.join(self.prefix, 'part.json'), json.dumps(part, indent=2))
+            for tag, data in self.allparts.items():
+                self.zip.writestr(os.path.join(self.prefix, tag), data)
 
-    def __del__(self):
-        if self.zip:
+    def rollover(self):
+        """
+        Prepare for a write (lock held): raise the error of a failed rollover, or close the
+        current part if it reached split_size and continue with the next
+        """
+        if self.error:
+            raise self.error
+        if not self.split_size or self.zip.fp.tell() < self.split_size:
+            return
+        entries = len(self.zip.namelist())
+        self.zip.close()
+        self.zip = None
+        self.files.append(self.path)
+        self.parts.append({ 'filename': os.path.basename(self.path), 'entries': entries, 'size': os.path.getsize(self.path) })
+        logging.info('Zip file part {0} is complete ({1} MiB), ready for transfer'.format(self.path, self.parts[-1]['size'] // 1048576))
+        try:
+            self.open(self.partpath(len(self.parts) + 1))
+        except ZipCreateError as e:
+            # Keep the index of the completed parts, fail all further writes
+            self.error = e
+            self.writeindex()
+            raise
+
+    def close(self):
+        """Close the zipfile, rename it to .failed.zip if not completed"""
+        with self.lock:
+            if not self.zip:
+                return
+            if self.split_size:
+                entries = len(self.zip.namelist()) + 1
+                self.parts.append({ 'filename': os.path.basename(self.path), 'entries': entries, 'size': None })
+                if self.ok is False:
+                    self.parts[-1]['filename'] = self.parts[-1]['filename'].replace('.zip','.failed.zip')
+                self.zip.writestr(os.path.join(self.prefix, 'parts.json'), self.index())
             self.zip.close()
+            self.zip = None
         if self.ok is False:
             os.rename(self.path, self.path.replace('.zip','.failed.zip'))
+            self.path = self.path.replace('.zip','.failed.zip')
+        self.files.append(self.path)
+        if self.split_size:
+            self.parts[-1]['size'] = os.path.getsize(self.path)
+            self.writeindex()
+
+    def index(self):
+        """Index of the parts (the size of the last part is only in the .parts.json file)"""
+        return json.dumps({ 'set': self.setid, 'hostname': self.prefix, 'complete': self.ok, 'parts': self.parts }, indent=2)
+
+    def writeindex(self):
+        """Write the index of the parts as <name>.parts.json"""
+        with open(re.sub(r'\.zip$', '', self.basepath) + '.parts.json', 'w') as f:
+            f.write(self.index())
+
+    @property
+    def size(self):
+        """Total size of the zipfile(s) after closing"""
+        return sum([os.path.getsize(path) for path in self.files if os.path.isfile(path)])
 
     def store(self, path, tag=None, ignore=False):
         if tag:
@@ -45,7 +141,9 @@ class Archive():
             logging.debug("Skipping %s (nonexisting)", path)
             return
         try:
-            self.zip.write(path, fulltag)
+            with self.lock:
+                self.rollover()
+                self.zip.write(path, fulltag)
         except OSError as e:
             if not ignore:
                 logging.error(Errors.E004, e.filename, os.strerror(e.errno))
@@ -53,8 +151,130 @@ class Archive():
             if not ignore:
                 logging.error(Errors.E005, e.filename, os.strerror(e.errno))
 
-    def writestr(self, tag, data):
+    def writestr(self, tag, data, allparts=False):
+        """Write a string, with allparts also to each next part of a split archive"""
+        try:
+            with self.lock:
+                self.rollover()
+                self.zip.writestr(os.path.join(self.prefix, tag.lstrip('/')), data)
+                if allparts:
+                    self.allparts[tag.lstrip('/')] = data
+        except ZipCreateError:
+            raise
+        except Exception as e:
+            logging.warning(Errors.W003, tag, str(e))
+
+    def writefile(self, tag, header, fileobj):
+        """
+        Write a header string followed by the contents of an open binary file, in chunks
+        Python 3.6+ writes directly into the zip entry, older versions via a temp file
+        """
+        name = os.path.join(self.prefix, tag.lstrip('/'))
+        fileobj.seek(0)
         try:
-            self.zip.writestr(os.path.join(self.prefix, tag.lstrip('/')), data)
+            if sys.version_info >= (3, 6):
+                zinfo = ZipInfo(name, time.localtime()[:6])
+                zinfo.compress_type = ZIP_DEFLATED
+                zinfo.external_attr = 0o600 << 16
+                with self.lock:
+                    self.rollover()
+                    with self.zip.open(zinfo, 'w', force_zip64=True) as f:
+                        f.write(header.encode('utf-8'))
+                        shutil.copyfileobj(fileobj, f, 65536)
+            else:
+                tmp = tempfile.NamedTemporaryFile()
+                try:
+                    tmp.write(header.encode('utf-8'))
+                    shutil.copyfileobj(fileobj, tmp, 65536)
+                    tmp.flush()
+                    with self.lock:
+                        self.rollover()
+                        self.zip.write(tmp.name, name)
+                finally:
+                    tmp.close()
+        except ZipCreateError:
+            raise
         except Exception as e:
             logging.warning(Errors.W003, tag, str(e))
+
+    def merge(self, path, label):
+        """
+        Add the entries of another dbcollect ZIP file (with the same hostname prefix)
+        The compressed data is copied as-is (no decompression and recompression).
+        Duplicate entries with the same contents (CRC and size) are skipped. Duplicates with
+        other contents get -<label> added to the name, with a warning if not a top-level
+        entry (top-level entries like meta.json and dbcollect.log are expected per run).
+        The index of a split source is not copied, meta.json goes to all parts of a split archive.
+        """
+        src = ZipFile(path)
+        try:
+            infolist = src.infolist()
+            meta     = os.path.join(self.prefix, 'meta.json')
+            if self.split_size and meta in src.namelist() and 'meta.json' not in self.allparts:
+                self.allparts['meta.json'] = src.read(meta)
+        finally:
+            src.close()
+        with self.lock:
+            if self.error:
+                raise self.error
+            names = dict([(info.filename, (info.CRC, info.file_size)) for info in self.zip.infolist()])
+            names.update(self.merged)
+        skip = [os.path.join(self.prefix, 'part.json'), os.path.join(self.prefix, 'parts.json')]
+        with open(path, 'rb') as f:
+            for info in infolist:
+                name = info.filename
+                if name in skip:
+                    continue
+                if name in names:
+                    if names[name] == (info.CRC, info.file_size):
+                        logging.debug('Skipping %s from %s (duplicate)', name, path)
+                        continue
+                    base, ext = os.path.splitext(name)
+                    name, n = '{0}-{1}{2}'.format(base, label, ext), 1
+                    while name in names:
+                        n += 1
+                        name = '{0}-{1}-{2}{3}'.format(base, label, n, ext)
+                    if info.filename.count('/') > 1:
+                        logging.warning(Errors.W023, path, info.filename, name)
+                names[name] = (info.CRC, info.file_size)
+                self.merged[name] = names[name]
+                self.copyraw(f, info, name)
+
+    def copyraw(self, f, info, name):
+        """Copy a compressed entry from open ZIP file f into the archive as name"""
+        f.seek(info.header_offset)
+        header = f.read(30)
+        if header[:4] != b'PK\x03\x04':
+            raise ZipCreateError(Errors.E047, f.name, info.filename)
+        namelen, extralen = struct.unpack('<HH', header[26:30])
+        f.seek(info.header_offset + 30 + namelen + extralen)
+
+        zinfo = ZipInfo(name, info.date_time)
+        zinfo.compress_type = info.compress_type
+        zinfo.external_attr = info.external_attr
+        zinfo.create_system = info.create_system
+        zinfo.flag_bits     = info.flag_bits & ~0x08 # Sizes are in the header, no data descriptor
+        zinfo.CRC           = info.CRC
+        zinfo.compress_size = info.compress_size
+        zinfo.file_size     = info.file_size
+        zip64 = max(info.compress_size, info.file_size) > ZIP64_LIMIT
+
+        with self.lock:
+            self.rollover()
+            zinfo.header_offset = self.zip.fp.tell()
+            if sys.version_info >= (2, 7):
+                self.zip.fp.write(zinfo.FileHeader(zip64))
+            else:
+                self.zip.fp.write(zinfo.FileHeader())
+            remaining = info.compress_size
+            while remaining > 0:
+                data = f.read(min(remaining, 1048576))
+                if not data:
+                    raise ZipCreateError(Errors.E047, f.name, info.filename)
+                self.zip.fp.write(data)
+                remaining -= len(data)
+            self.zip.filelist.append(zinfo)
+            self.zip.NameToInfo[zinfo.filename] = zinfo
+            # Python 3 writes the central directory at start_dir
+            self.zip.start_dir = self.zip.fp.tell()
+            self.zip._didModify = True
@@ -0,0 +1,729 @@
+"""
+backend.py - Query execution backends for DBCollect
+Copyright (c) 2024 - Bart Sjerps <bart@dirty-cache.com>
+License: GPLv3+
+
+All database interaction goes through a backend (selected with --backend):
+
+sqlplus: Run bin/sqlplus from the ORACLE_HOME and spool output to text files (default)
+driver:  Run queries in-process using python-oracledb or cx_Oracle (if installed)
+fake:    Answer from memory, for testing and benchmarking without a database
+
+With --record, the backend is wrapped to record all calls (lib/replay.py),
+with --replay the recorded results are returned instead of using a database.
+
+A backend returns the instance status (detection), runs the metadata scripts
+(meta.sql, getawrs.sql, getsps.sql) and creates sessions. A session runs dbinfo
+scripts and AWR/Statspack queries and spools the output to a file in the tempdir.
+"""
+
+import os, re, csv, json, time, zlib, logging
+from abc import ABCMeta, abstractmethod
+from datetime import datetime, timedelta
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from lib.config import fake_config
+from lib.errors import Errors, CustomException, LogonDenied, OracleNotAvailable, SQLPlusError, SQLConnectionError, SQLError, SQLTimeout
+from lib.functions import getscript
+from lib.sqlplus import sqlplus
+from lib.replay import recording, record_event, record_error, replay_event, payload, text, checksum
+
+try:
+    import oracledb as driver
+except ImportError:
+    try:
+        import cx_Oracle as driver
+    except ImportError:
+        driver = None
+
+_backends = {}
+
+def get_backend(args):
+    """Return the backend selected with --backend (one per process)"""
+    name = args.backend
+    if name not in _backends:
+        if args.replay:
+            backend = ReplayBackend()
+        elif name == 'sqlplus':
+            backend = SQLPlusBackend()
+        elif name == 'driver':
+            backend = DriverBackend()
+        elif name == 'fake':
+            backend = FakeBackend()
+        else:
+            raise ValueError('Bad backend', name)
+        if recording():
+            backend = RecordBackend(backend)
+        _backends[name] = backend
+    return _backends[name]
+
+def check_oraerror(text):
+    """
+    Raise an exception for the first ORA-* error in text
+    Known errors:
+    ORA-00942: table or view does not exist
+    ORA-01017: invalid username/password; logon denied
+    ORA-01033: ORACLE initialization or shutdown in progress
+    ORA-01034: ORACLE not available
+    ORA-01045: user <user> lacks CREATE SESSION privilege; logon denied
+    ORA-12154: TNS:could not resolve the connect identifier specified
+    ORA-12514: TNS:listener does not currently know of service requested in connect
+    ORA-12528: TNS:listener: all appropriate instances are blocking new connections
+    ORA-12537: TNS:connection closed
+    ORA-12541: TNS:no listener
+    ORA-12543: TNS:destination host unreachable
+    ORA-12547, TNS:lost contact
+    ORA-28000: The account is locked.
+    """
+    for oerr, msg in re.findall(r'^(ORA-\d+):\s+(.*)', text, re.M):
+        if oerr == 'ORA-01017':
+            # usually happens when using the wrong ORACLE_HOME or incorrect groups, try the next one
+            raise LogonDenied
+
+        if oerr == 'ORA-01034':
+            # usually happens when using the wrong ORACLE_HOME, try the next one
+            raise OracleNotAvailable
+
+        # Other ORA errors
+        raise SQLError(oerr, msg)
+
+class Backend(ABCMeta('ABC', (object,), {})):
+    """
+    Base class for query backends
+    Backends implement status(), script() and session(), discover() is optional
+    """
+    name = None
+
+    def discover(self, args):
+        """Return a list of (sid, orahome, connectstring), or None to use the default instance detection"""
+        return None
+
+    @abstractmethod
+    def status(self, sid, orahome, connectstring, timeout=None):
+        """Return the instance status, raise an exception if the instance is not usable"""
+
+    @abstractmethod
+    def script(self, instance, name, header=None):
+        """Run a metadata script (meta, getawrs, getsps) and return the output"""
+
+    @abstractmethod
+    def session(self, instance, tempdir, args):
+        """Return a session for running dbinfo scripts and reports"""
+
+class SQLPlusBackend(Backend):
+    """Run SQL*Plus from the ORACLE_HOME"""
+    name = 'sqlplus'
+
+    def status(self, sid, orahome, connectstring, timeout=None):
+        proc     = sqlplus(orahome, sid, connectstring, '/tmp', timeout=timeout)
+        out, err = proc.communicate('WHENEVER SQLERROR EXIT SQL.SQLCODE\nSET HEAD OFF PAGES 0\nSELECT STATUS from v$instance;')
+
+        if proc.returncode == 0:
+            return out.strip()
+
+        if proc.returncode == 124:
+            # timeout command exit code
+            raise SQLTimeout
+
+        if proc.returncode == 127:
+            # sqlplus executable
+            raise SQLPlusError(Errors.E019, sid, 'rc=127')
+
+        check_oraerror(out)
+
+        logging.debug('sqlplus output:\n%s', out)
+        raise SQLConnectionError(Errors.E001, 'SQL*Plus failed without ORA-* error')
+
+    def connect(self, instance, quiet=False):
+        """Create SQL*Plus session and initialize with header"""
+        proc = sqlplus(instance.orahome, instance.sid, instance.connect, instance.tempdir, quiet=quiet)
+        proc.stdin.write("SET tab off feedback off verify off heading off lines 32767 pages 0 trims on\n")
+        proc.stdin.write("alter session set nls_date_language=american;\n")
+
+        # Handle Bug 19033356 - SQLPLUS WHENEVER OSERROR FAILS REGARDLESS OF OS COMMAND RESULT.
+        proc.stdin.write("whenever oserror continue;\n")
+
+        return proc
+
+    def script(self, instance, name, header=None):
+        """Run SQL*Plus query and return the output. Log errors if they appear"""
+        sql = getscript(name + '.sql')
+        proc = self.connect(instance)
+        if header:
+            proc.stdin.write(header)
+        else:
+            proc.stdin.write("SET tab off feedback off verify off heading off lines 1000 pages 0 trims on\n")
+        out, _ = proc.communicate(sql)
+        if proc.returncode:
+            logging.debug('SQL*Plus output for query {0}.sql:\n{1}'.format(name, out))
+            raise SQLPlusError(Errors.E041, instance.sid, proc.returncode)
+        return out.strip()
+
+    def session(self, instance, tempdir, args):
+        return SQLPlusSession(self, instance, tempdir, args)
+
+class SQLPlusSession():
+    """SQL*Plus session, spools query output to files in the tempdir"""
+    format = 'sqlplus'
+
+    def __init__(self, backend, instance, tempdir, args):
+        self.backend  = backend
+        self.instance = instance
+        self.tempdir  = tempdir
+        self.args     = args
+        self.sid      = instance.sid
+        self.proc     = self.start()
+
+    def __del__(self):
+        """Send exit to SQLPlus if it is still running"""
+        if self.proc.returncode is None:
+            self.proc.communicate('exit;\n')
+
+    def start(self):
+        """Start a new SQL*Plus process"""
+        proc = self.backend.connect(self.instance, quiet=True)
+        proc.stdin.write('WHENEVER SQLERROR EXIT SQL.SQLCODE\n')
+        return proc
+
+    @property
+    def logfile(self):
+        return os.path.join(self.tempdir, 'log', "{0}_sqlplus_{1}.log".format(self.sid, self.proc.pid))
+
+    def send(self, s):
+        """Send command to SQLPlus and log to logfile"""
+        with open(self.logfile, 'a') as f:
+            f.write(s)
+        self.proc.stdin.write(s)
+
+    def run(self, name, query, filename=None, header=None, timeout=None):
+        """Run a query using SQLPlus, timeout (seconds) overrides --timeout"""
+
+        # Restart SQLPlus if needed
+        self.proc.poll()
+        if self.proc.returncode is not None:
+            logging.debug('rc={0}, Starting new SQLPlus process'.format(self.proc.returncode))
+            self.proc = self.start()
+
+        # Setup paths and record start time
+        spoolfile = os.path.join(self.tempdir, filename or 'out.txt')
+        statfile  = os.path.join(self.tempdir, '{0}_status'.format(self.proc.pid))
+        starttime = time.time()
+
+        # Send commands to SQLPlus
+        if header is not None:
+            self.send(header)
+        self.send('SPOOL {0}\n'.format(filename or 'out.txt'))
+        self.send(query)
+        self.send('\nSPOOL OFF\n')
+        self.send('HOST touch {0}\n'.format(statfile))
+
+        # Wait for the status file to appear and check for errors or timeouts
+        while not os.path.exists(statfile):
+            time.sleep(0.01)
+            self.proc.poll()
+
+            if self.proc.returncode is not None:
+                try:
+                    with open(spoolfile) as f:
+                        data = f.read()
+                except (OSError, IOError):
+                    data = ''
+
+                for err, msg in re.findall(r'^(ORA-\d+):(.*)', data, re.M):
+                    if err == 'ORA-00904':
+                        raise SQLError(Errors.E040, name, self.sid, err, msg)
+                    logging.debug('\n%s', data)
+
+                raise SQLError(Errors.E009, self.sid, self.proc.pid, self.proc.returncode, name)
+
+            elapsed = round(time.time() - starttime,2)
+            if elapsed > (timeout or self.args.timeout * 60):
+                self.proc.kill()
+                raise SQLTimeout(Errors.E010, self.sid, self.proc.pid, round(elapsed), name)
+
+        elapsed = round(time.time() - starttime,2)
+        self.proc.poll()
+
+        # Remove status file if exists
+        try:
+            os.unlink(statfile)
+            status = 'OK'
+        except OSError:
+            status = 'ERROR'
+
+        return elapsed, self.proc.returncode, status, spoolfile
+
+class ScriptRunner():
+    """
+    Minimal SQL*Plus script interpreter for the driver backend
+    Runs SQL and PL/SQL statements, handles PROMPT, DEFINE, SET SERVEROUTPUT, SET ROWLIMIT and SET FEEDBACK
+    and ignores other SQL*Plus (formatting) commands.
+    Query results are written as CSV with a heading row (fmt csv), as fixed width columns
+    with headings like SQL*Plus (fmt text), or as plain text lines (reports).
+    """
+    ignored = ('SET', 'COL', 'COLUMN', 'BREAK', 'COMPUTE', 'CLEAR', 'TTITLE', 'BTITLE', 'WHENEVER',
+               'SPOOL', 'HOST', 'SHOW', 'REM', 'REMARK', 'UNDEFINE', 'PAUSE', 'EXIT')
+
+    def __init__(self, conn, out, fmt=None, arraysize=500):
+        self.conn      = conn
+        self.out       = out
+        self.fmt       = fmt
+        self.arraysize = arraysize
+        self.defines   = {}
+        self.dbmsout   = False
+        self.rowlimit  = None
+        self.feedback  = False
+
+    def statements(self, script):
+        """Split a SQL*Plus script into (kind, text) tuples"""
+        buf, kind = [], None
+        for line in script.splitlines():
+            stripped = line.strip()
+            if kind is None:
+                if not stripped or stripped.startswith('--') or stripped == '/':
+                    continue
+                word = stripped.split()[0].upper()
+                if word == 'PROMPT':
+                    yield 'prompt', stripped[6:].strip()
+                    continue
+                elif word in ('DEF', 'DEFINE'):
+                    yield 'define', stripped
+                    continue
+                elif word == 'SET' and re.search(r'\bSERVEROUT(PUT)?\s+ON', stripped, re.I):
+                    yield 'serveroutput', stripped
+                    continue
+                elif word == 'SET' and re.search(r'\bROWLIMIT\b', stripped, re.I):
+                    yield 'rowlimit', stripped
+                    continue
+                elif word == 'SET' and re.match(r'SET\s+FEED(BACK)?\s+\S+$', stripped, re.I):
+                    yield 'feedback', stripped
+                    continue
+                elif word in self.ignored or word.startswith('@'):
+                    yield 'command', stripped
+                    continue
+                kind = 'plsql' if word in ('DECLARE', 'BEGIN') else 'sql'
+
+            if stripped == '/':
+                yield kind, '\n'.join(buf)
+                buf, kind = [], None
+                continue
+
+            buf.append(line)
+            if kind == 'sql' and stripped.endswith(';') and not stripped.startswith('--'):
+                yield kind, '\n'.join(buf).rstrip().rstrip(';')
+                buf, kind = [], None
+
+        if buf:
+            yield kind, '\n'.join(buf)
+
+    def substitute(self, text):
+        """Replace &var and &&var with defined values"""
+        return re.sub(r'&&?(\w+)\.?', lambda m: self.defines.get(m.group(1).lower(), m.group(0)), text)
+
+    def run(self, script):
+        """Run all statements in the script"""
+        for kind, text in self.statements(script):
+            if kind == 'prompt':
+                self.out.write(text + '\n')
+            elif kind == 'define':
+                r = re.match(r'^\w+\s+(\w+)\s*=\s*(.*)$', text)
+                if r:
+                    self.defines[r.group(1).lower()] = r.group(2).strip().strip('\'"')
+            elif kind == 'serveroutput':
+                self.dbmsout = True
+                self.conn.cursor().callproc('dbms_output.enable', [None])
+            elif kind == 'rowlimit':
+                r = re.search(r'ROWLIMIT\s+(\d+)', text, re.I)
+                self.rowlimit = int(r.group(1)) if r else None
+            elif kind == 'feedback':
+                self.feedback = text.split()[-1].upper() not in ('OFF', '0')
+            elif kind in ('sql', 'plsql'):
+                self.execute(kind, text)
+
+    def execute(self, kind, text):
+        """Execute a statement and write the results"""
+        cursor = self.conn.cursor()
+        cursor.arraysize = self.arraysize
+        cursor.execute(self.substitute(text))
+        if cursor.description:
+            writer = csv.writer(self.out, lineterminator='\n') if self.fmt == 'csv' else None
+            widths = None
+            if writer:
+                writer.writerow([col[0] for col in cursor.description])
+            elif self.fmt == 'text':
+                widths = [max(len(col[0]), min(col[2] or 10, 80)) for col in cursor.description]
+                self.out.write(' '.join([col[0].ljust(w) for col, w in zip(cursor.description, widths)]).rstrip() + '\n')
+                self.out.write(' '.join(['-' * w for w in widths]) + '\n')
+            fetched = 0
+            while True:
+                rows = cursor.fetchmany()
+                if not rows:
+                    break
+                if self.rowlimit:
+                    rows = rows[:self.rowlimit - fetched]
+                fetched += len(rows)
+                for row in rows:
+                    values = [_value(v) for v in row]
+                    if writer:
+                        writer.writerow(values)
+                    elif widths:
+                        self.out.write(' '.join([v.ljust(w) for v, w in zip(values, widths)]).rstrip() + '\n')
+                    else:
+                        self.out.write(' '.join(values) + '\n')
+                if self.rowlimit and fetched >= self.rowlimit:
+                    break
+            if self.feedback and fetched:
+                self.out.write('\n{0} {1} selected.\n'.format(fetched, 'row' if fetched == 1 else 'rows'))
+        if kind == 'plsql' and self.dbmsout:
+            line, status = cursor.var(str), cursor.var(int)
+            while True:
+                cursor.callproc('dbms_output.get_line', (line, status))
+                if status.getvalue() != 0:
+                    break
+                self.out.write((line.getvalue() or '') + '\n')
+        cursor.close()
+
+def _value(v):
+    """Format a fetched value like SQL*Plus would"""
+    if v is None:
+        return ''
+    if isinstance(v, datetime):
+        return v.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    if hasattr(v, 'read'):
+        return v.read()
+    return str(v)
+
+class DriverBackend(Backend):
+    """
+    Run queries in-process using python-oracledb or cx_Oracle
+    Connections without connectstring (as sysdba) use the client libraries
+    from the ORACLE_HOME (thick mode), only one ORACLE_HOME per process can be used.
+    """
+    name = 'driver'
+
+    def __init__(self):
+        if driver is None:
+            raise CustomException(Errors.E045)
+        self.orahome = None
+
+    def connect(self, sid, orahome, connectstring, timeout=None):
+        """Connect to the instance, as sysdba if no connectstring is given"""
+        if connectstring:
+            r = re.match(r'^(\w+)/(\S+?)@(\S+)$', connectstring)
+            if not r:
+                raise CustomException(Errors.E043, connectstring)
+            user, password, dsn = r.groups()
+            conn = driver.connect(user=user, password=password, dsn=dsn)
+        else:
+            os.environ['ORACLE_HOME'] = orahome
+            os.environ['ORACLE_SID']  = sid
+            if self.orahome is None:
+                self.orahome = orahome
+                if hasattr(driver, 'init_oracle_client'):
+                    driver.init_oracle_client()
+            elif self.orahome != orahome:
+                logging.debug('%s: Using client libraries from %s', sid, self.orahome)
+            mode = getattr(driver, 'AUTH_MODE_SYSDBA', None) or driver.SYSDBA
+            conn = driver.connect(mode=mode)
+        if timeout and hasattr(conn, 'call_timeout'):
+            conn.call_timeout = int(timeout * 1000)
+        return conn
+
+    def status(self, sid, orahome, connectstring, timeout=None):
+        try:
+            conn   = self.connect(sid, orahome, connectstring, timeout)
+            cursor = conn.cursor()
+            cursor.execute('SELECT status FROM v$instance')
+            status = cursor.fetchone()[0]
+            conn.close()
+            return status
+
+        except driver.DatabaseError as e:
+            if re.search(r'DPI-1067|DPY-4024', str(e)):
+                # call timeout exceeded
+                raise SQLTimeout
+            check_oraerror(str(e))
+            logging.debug('driver error: %s', e)
+            raise SQLConnectionError(Errors.E001, str(e))
+
+    def script(self, instance, name, header=None):
+        """Run a script in-process and return the output"""
+        out = StringIO()
+        try:
+            conn   = self.connect(instance.sid, instance.orahome, instance.connect)
+            runner = ScriptRunner(conn, out)
+            if header:
+                runner.run(header)
+            runner.run(getscript(name + '.sql'))
+            conn.close()
+        except driver.DatabaseError as e:
+            logging.debug('Driver error for query {0}.sql: {1}'.format(name, e))
+            raise SQLPlusError(Errors.E041, instance.sid, str(e).split(':')[0])
+        return out.getvalue().strip()
+
+    def session(self, instance, tempdir, args):
+        return DriverSession(self, instance, tempdir, args)
+
+class DriverSession():
+    """
+    Driver session, spools query output to files in the tempdir
+    dbinfo scripts (which come with a header) are written as CSV with --dbinfo-format csv,
+    else as fixed width text like SQL*Plus. Reports are written as plain text.
+    Statspack reports call scripts from the ORACLE_HOME and are passed on to SQL*Plus.
+    Row limits (SET ROWLIMIT) are applied by the session for any Oracle version.
+    """
+    rowlimit = True
+
+    def __init__(self, backend, instance, tempdir, args):
+        self.backend  = backend
+        self.instance = instance
+        self.tempdir  = tempdir
+        self.args     = args
+        self.sid      = instance.sid
+        self.format   = 'csv' if args.dbinfo_format == 'csv' else 'sqlplus'
+        self.conn     = backend.connect(instance.sid, instance.orahome, instance.connect, args.timeout * 60)
+        self.fallback = None
+
+    def __del__(self):
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+
+    def run(self, name, query, filename=None, header=None, timeout=None):
+        """Run a query in-process, timeout (seconds) overrides --timeout"""
+        if re.search(r'^@', query, re.M):
+            if self.fallback is None:
+                self.fallback = SQLPlusBackend().session(self.instance, self.tempdir, self.args)
+            return self.fallback.run(name, query, filename, header, timeout)
+
+        spoolfile = os.path.join(self.tempdir, filename or 'out.txt')
+        starttime = time.time()
+        if timeout and hasattr(self.conn, 'call_timeout'):
+            self.conn.call_timeout = int(timeout * 1000)
+        try:
+            with open(spoolfile, 'w') as f:
+                fmt    = None
+                if header is not None:
+                    fmt = 'csv' if self.format == 'csv' else 'text'
+                runner = ScriptRunner(self.conn, f, fmt)
+                if header is not None:
+                    runner.run(header)
+                runner.run(query)
+
+        except driver.DatabaseError as e:
+            elapsed = round(time.time() - starttime,2)
+            if re.search(r'DPI-1067|DPY-4024', str(e)):
+                raise SQLTimeout(Errors.E010, self.sid, os.getpid(), round(elapsed), name)
+            r = re.search(r'(ORA-\d+):(.*)', str(e))
+            if r and r.group(1) == 'ORA-00904':
+                raise SQLError(Errors.E040, name, self.sid, r.group(1), r.group(2))
+            logging.debug('\n%s', e)
+            raise SQLError(Errors.E009, self.sid, os.getpid(), r.group(1) if r else None, name)
+
+        finally:
+            if timeout and hasattr(self.conn, 'call_timeout'):
+                self.conn.call_timeout = int(self.args.timeout * 60 * 1000)
+
+        elapsed = round(time.time() - starttime,2)
+        return elapsed, 0, 'OK', spoolfile
+
+class FakeBackend(Backend):
+    """
+    In-memory backend for testing and benchmarking without a database
+    Settings are taken from fake_config (lib/config.py) and can be overridden
+    with DBCOLLECT_FAKE_<SETTING> environment variables.
+    """
+    name = 'fake'
+
+    def __init__(self):
+        self.config = dict(fake_config)
+        for key, val in fake_config.items():
+            env = os.environ.get('DBCOLLECT_FAKE_{0}'.format(key.upper()))
+            if env is not None:
+                self.config[key] = type(val)(env)
+
+    def discover(self, args):
+        instances = []
+        for n in range(self.config['instances']):
+            instances.append(('FAKE{0}'.format(n + 1), self.config['orahome'], None))
+        return instances
+
+    def status(self, sid, orahome, connectstring, timeout=None):
+        return 'OPEN'
+
+    def meta(self, sid):
+        """Instance metadata as returned by meta.sql"""
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        return {
+            'instance_number': 1,
+            'instance_name': sid.lower(),
+            'host_name': os.uname()[1],
+            'version': '19.0.0.0.0',
+            'startup_time': now,
+            'status': 'OPEN',
+            'parallel': 'YES' if self.config['rac'] > 1 else 'NO',
+            'sysdate': now,
+            'dbuser': 'SYS',
+            'version_major': 19,
+            'dbid': str(zlib.crc32(sid.encode('utf-8')) & 0x7fffffff),
+            'dbname': sid,
+            'db_unique_name': sid,
+            'database_role': 'PRIMARY',
+            'created': now,
+            'sockets': 1,
+            'cores': self.config['cpus'] // 2,
+            'cpus': self.config['cpus'],
+            'statspack': 0,
+            'awrusage': 1,
+        }
+
+    def script(self, instance, name, header=None):
+        if name == 'meta':
+            return json.dumps(self.meta(instance.sid), indent=2)
+
+        defines  = dict(re.findall(r'define (\w+) = (\S+)', header or ''))
+        days     = int(defines.get('days', 10))
+        end_days = int(defines.get('end_days', 0))
+        instnums = range(1, self.config['rac'] + 1) if defines.get('inc_rac', '1') == '1' else [1]
+        if defines.get('rac_part') == '1':
+            # All fake RAC instances are active, so this node only gets its own instance
+            instnums = [1]
+        dbid     = self.meta(instance.sid)['dbid']
+        interval = timedelta(minutes=self.config['interval'])
+        now      = datetime.now().replace(minute=0, second=0, microsecond=0)
+        lines    = []
+        snap     = 1
+        endtime  = now - timedelta(days=days)
+        while endtime + interval <= now - timedelta(days=end_days):
+            begintime, endtime = endtime, endtime + interval
+            for instnum in instnums:
+                lines.append('{0},{1},{2},{3},{4},{5}'.format(dbid, instnum, snap, snap + 1,
+                    begintime.strftime('%Y%m%d_%H%M'), endtime.strftime('%Y%m%d_%H%M')))
+            snap += 1
+        return '\n'.join(lines)
+
+    def session(self, instance, tempdir, args):
+        return FakeSession(self, instance, tempdir, args)
+
+class FakeSession():
+    """Fake session, writes generated output with configurable latency and size"""
+    format = 'sqlplus'
+
+    def __init__(self, backend, instance, tempdir, args):
+        self.config  = backend.config
+        self.tempdir = tempdir
+
+    def run(self, name, query, filename=None, header=None, timeout=None):
+        spoolfile = os.path.join(self.tempdir, filename or 'out.txt')
+        starttime = time.time()
+        with open(spoolfile, 'w') as f:
+            if 'dbms_workload_repository' in query:
+                time.sleep(self.config['latency'])
+                row  = '<tr><td class="awrc">fake statistic</td><td align="right" class="awrc">12,345.67</td></tr>\n'
+                size = 0
+                f.write('<html><head><title>AWR Report</title></head><body>\n<table border="1" summary="fake">\n')
+                while size < self.config['reportsize']:
+                    f.write(row)
+                    size += len(row)
+                f.write('</table>\n</body></html>\n')
+            else:
+                time.sleep(self.config['latency'] / 10)
+                f.write('{0}\n'.format(name))
+        elapsed = round(time.time() - starttime,2)
+        return elapsed, 0, 'OK', spoolfile
+
+class RecordBackend(Backend):
+    """Wraps a backend and records all calls (--record)"""
+    def __init__(self, backend):
+        self.backend = backend
+        self.name    = backend.name
+
+    def discover(self, args):
+        return self.backend.discover(args)
+
+    def status(self, sid, orahome, connectstring, timeout=None):
+        return self.backend.status(sid, orahome, connectstring, timeout)
+
+    def script(self, instance, name, header=None):
+        key = '{0}:{1}:{2}'.format(instance.sid, name, checksum(header))
+        starttime = time.time()
+        try:
+            out = self.backend.script(instance, name, header)
+        except Exception as e:
+            record_error('script', key, time.time() - starttime, e)
+            raise
+        record_event('script', key, time.time() - starttime, { 'output': out })
+        return out
+
+    def session(self, instance, tempdir, args):
+        starttime = time.time()
+        session   = self.backend.session(instance, tempdir, args)
+        record_event('connect', instance.sid, time.time() - starttime, format=session.format, rowlimit=getattr(session, 'rowlimit', False))
+        return RecordSession(session, instance)
+
+class RecordSession():
+    """Wraps a session and records all queries with their spool output"""
+    def __init__(self, session, instance):
+        self.session  = session
+        self.sid      = instance.sid
+        self.format   = session.format
+        self.rowlimit = getattr(session, 'rowlimit', False)
+
+    def run(self, name, query, filename=None, header=None, timeout=None):
+        key = '{0}:{1}:{2}'.format(self.sid, filename, checksum((header or '') + query))
+        starttime = time.time()
+        try:
+            elapsed, rc, status, spoolfile = self.session.run(name, query, filename, header, timeout)
+        except Exception as e:
+            record_error('session', key, time.time() - starttime, e, payloads={ 'input': (header or '') + query })
+            raise
+        output = ('path', spoolfile) if os.path.isfile(spoolfile) else None
+        record_event('session', key, time.time() - starttime, { 'input': (header or '') + query, 'spool': output }, result=[elapsed, rc, status])
+        return elapsed, rc, status, spoolfile
+
+class ReplayBackend(Backend):
+    """Returns the results of a recording (--replay) with the recorded latencies"""
+    name = 'replay'
+
+    def discover(self, args):
+        event = replay_event('discover', 'instances')
+        return [tuple(x) for x in event['result']] if event else []
+
+    def status(self, sid, orahome, connectstring, timeout=None):
+        return 'OPEN'
+
+    def script(self, instance, name, header=None):
+        event = replay_event('script', '{0}:{1}:{2}'.format(instance.sid, name, checksum(header)))
+        if event is None:
+            raise SQLPlusError(Errors.E041, instance.sid, 'not recorded')
+        return text(payload(event, 'output'))
+
+    def session(self, instance, tempdir, args):
+        return ReplaySession(instance, tempdir)
+
+class ReplaySession():
+    """Replays the recorded queries of a session, the recorded spool output is written to the spool file"""
+    def __init__(self, instance, tempdir):
+        event = replay_event('connect', instance.sid)
+        self.format   = event['format'] if event else 'sqlplus'
+        self.rowlimit = event.get('rowlimit', False) if event else False
+        self.sid     = instance.sid
+        self.tempdir = tempdir
+
+    def run(self, name, query, filename=None, header=None, timeout=None):
+        spoolfile = os.path.join(self.tempdir, filename or 'out.txt')
+        event = replay_event('session', '{0}:{1}:{2}'.format(self.sid, filename, checksum((header or '') + query)))
+        with open(spoolfile, 'wb') as f:
+            if event is not None:
+                f.write(payload(event, 'spool') or b'')
+        if event is None:
+            return 0, 0, 'ERROR', spoolfile
+        elapsed, rc, status = event['result']
+        return elapsed, rc, status, spoolfile
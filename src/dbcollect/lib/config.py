@@ -13,6 +13,21 @@ versioninfo = {
 
 settings = {
     'logpath': "/tmp/dbcollect.log",
+    'os_tasks': 4,                     # Number of OS commands running concurrently
+    'cmd_min_timeout': 10,             # Minimum timeout (seconds) for inventory commands, also if the OS time budget is used up
+    'metrics_interval': 30,            # Seconds between metrics file updates (--metrics)
+    'monitor_interval': 5,             # Seconds between self-impact samples (monitor.jsonl)
+}
+
+# Settings for the fake backend (--backend fake), override with DBCOLLECT_FAKE_<SETTING>
+fake_config = {
+    'instances':  1,                   # Number of fake instances
+    'rac':        1,                   # Number of RAC instances in the AWR repository
+    'cpus':       8,                   # NUM_CPUS
+    'interval':   60,                  # AWR snapshot interval (minutes)
+    'latency':    0.05,                # Seconds per AWR report
+    'reportsize': 1048576,             # Size of an AWR report (bytes)
+    'orahome':    '/opt/oracle/fake',  # Fake ORACLE_HOME
 }
 
 dbinfo_config = {
@@ -76,6 +91,56 @@ dbinfo_config = {
     ],
 }
 
+# dbinfo scripts with database-wide results (all others are instance-scoped)
+# These run once per database per run, other instances of the same database
+# (i.e. RAC instances) get a reference to the first result.
+# Scripts using v$pdbs or CDB_ views (pdb_*) only see the PDBs open on the
+# current instance and remain instance-scoped, like dataguard_config.sql
+dbinfo_database = [
+    'dbfiles.sql',
+    'dbsize.sql',
+    'redologs.sql',
+    'archivelogs.sql',
+    'archivesummary.sql',
+    'bctracking.sql',
+    'flashback.sql',
+    'rmanconfig.sql',
+    'backupjobs.sql',
+    'backups.sql',
+    'awrretention.sql',
+    'awrerrors.sql',
+    'awrsnaps.sql',
+    'awrsummary.sql',
+    'features.sql',
+    'watermarks.sql',
+    'db_tablespaces.sql',
+    'db_tsfiles.sql',
+    'db_tempfiles.sql',
+    'db_freespace.sql',
+    'db_tempspace.sql',
+    'db_segments.sql',
+    'db_recyclebin.sql',
+    'db_compression.sql',
+    'pdb_cdbinfo.sql',
+]
+
+# Limits for heavy dbinfo scripts, other scripts only use --timeout
+# timeout: seconds before the script is cancelled (never more than --timeout)
+# rows:    max rows per query (SQL*Plus 18c+ SET ROWLIMIT, or driver backend),
+#          the report header has the applied rows and truncated if the limit was reached
+dbinfo_limits = {
+    'db_segments.sql':      { 'timeout': 600 },
+    'pdb_segments.sql':     { 'timeout': 600 },
+    'db_freespace.sql':     { 'timeout': 300 },
+    'pdb_freespace.sql':    { 'timeout': 300 },
+    'db_compression.sql':   { 'timeout': 300 },
+    'pdb_compression.sql':  { 'timeout': 300 },
+    'db_recyclebin.sql':    { 'timeout': 300 },
+    'pdb_recyclebin.sql':   { 'timeout': 300 },
+    'dbfiles.sql':          { 'rows': 100000 },
+    'backups.sql':          { 'rows': 100000 },
+}
+
 linux_config = {
     'commands': {
         'lscpu': 'lscpu',
@@ -1,8 +1,8 @@
 import os, re, logging, pwd, grp
 
-from lib.errors import Errors, CustomException, SQLError, OracleNotAvailable, LogonDenied, SQLConnectionError, SQLPlusError, SQLTimeout
+from lib.errors import Errors, CustomException, SQLError, OracleNotAvailable, LogonDenied, SQLConnectionError, SQLTimeout
 from lib.functions import execute, getfile
-from lib.sqlplus import sqlplus
+from lib.backend import get_backend
 
 def sqlplus_status(args, sid, orahome, connectstring):
     """Get instance status"""
@@ -10,51 +10,13 @@ def sqlplus_status(args, sid, orahome, connectstring):
     if args.no_timeout:
         timeout = None
 
-    proc     = sqlplus(orahome, sid, connectstring, '/tmp', timeout=timeout)
-    out, err = proc.communicate('WHENEVER SQLERROR EXIT SQL.SQLCODE\nSET HEAD OFF PAGES 0\nSELECT STATUS from v$instance;')
-
-    if proc.returncode == 0:
-        return out.strip()
-
-    if proc.returncode == 124:
-        # timeout command exit code
-        raise SQLTimeout
-
-    if proc.returncode == 127:
-        # sqlplus executable 
-        raise SQLPlusError(Errors.E019, sid, 'rc=127')
-
-    for oerr, msg in re.findall(r'^(ORA-\d+):\s+(.*)', out, re.M):
-        """
-        Known errors:
-        ORA-00942: table or view does not exist
-        ORA-01017: invalid username/password; logon denied
-        ORA-01033: ORACLE initialization or shutdown in progress
-        ORA-01034: ORACLE not available
-        ORA-01045: user <user> lacks CREATE SESSION privilege; logon denied
-        ORA-12154: TNS:could not resolve the connect identifier specified
-        ORA-12514: TNS:listener does not currently know of service requested in connect
-        ORA-12528: TNS:listener: all appropriate instances are blocking new connections
-        ORA-12537: TNS:connection closed
-        ORA-12541: TNS:no listener
-        ORA-12543: TNS:destination host unreachable
-        ORA-12547, TNS:lost contact
-        ORA-28000: The account is locked.
-        """
-        if oerr == 'ORA-01017':
-            # usually happens when using the wrong ORACLE_HOME or incorrect groups, try the next one
-            check_dba_group(sid, orahome)
-            raise LogonDenied
-
-        if oerr == 'ORA-01034':
-            # usually happens when using the wrong ORACLE_HOME, try the next one
-            raise OracleNotAvailable
-
-        # Other ORA errors
-        raise SQLError(oerr, msg)
-    
-    logging.debug('sqlplus output:\n%s', out)
-    raise SQLConnectionError(Errors.E001, 'SQL*Plus failed without ORA-* error')
+    try:
+        return get_backend(args).status(sid, orahome, connectstring, timeout)
+
+    except LogonDenied:
+        # usually happens when using the wrong ORACLE_HOME or incorrect groups, try the next one
+        check_dba_group(sid, orahome)
+        raise
 
 def check_dba_group(sid, orahome):
     """Check if current user is member of the OSDBA group"""
@@ -175,6 +137,11 @@ def get_instances(args):
     excluded  = args.exclude.split(',') if args.exclude else []
     included  = args.include.split(',') if args.include else []
 
+    # Backends that provide their own instances (fake)
+    discovered = get_backend(args).discover(args)
+    if discovered is not None:
+        return discovered
+
     # Check if timeout command works
     try:
         execute('timeout --version')
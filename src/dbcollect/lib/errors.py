@@ -34,6 +34,9 @@ class SQLTimeout(CustomException):
 class InstanceNotAvailable(CustomException):
     pass
 
+class CommandTimeout(CustomException):
+    pass
+
 class Errors():
     """
     Info, Warning and Error messages
@@ -55,6 +58,13 @@ class Errors():
     W015 = "[DBC-W015] Using only connectstrings (skipping local instances detection)"
     W016 = "[DBC-W016] %s: (%s) SQL*Plus Error %s, %s"
     W017 = "[DBC-W017] %s: Oracle not available (ORA-01034), skipping %s"
+    W018 = "[DBC-W018] Command %s timed out after %s seconds"
+    W019 = "[DBC-W019] Skipping %s: OS collection time budget exceeded"
+    W020 = "[DBC-W020] Writing metrics file %s failed: %s, metrics disabled"
+    W021 = "[DBC-W021] Collection for user %s failed (returncode %s), see the logfile in the zip file"
+    W022 = "[DBC-W022] Cannot stop command %s (pid %s) after timeout: %s"
+    W023 = "[DBC-W023] Merging %s: %s already exists with other contents, stored as %s"
+    W024 = "[DBC-W024] %s: Output of %s reached the row limit of %s rows and may be truncated"
 
     E001 = "[DBC-E001] Unknown error: %s, see logfile for debug info"
     E002 = "[DBC-E002] Keyboard interrupt, Aborting..."
@@ -100,6 +110,11 @@ class Errors():
     E042 = "[DBC-E042] %s: No valid ORACLE_HOME found (see logfile)"
     E043 = "[DBC-E043] Bad connectstring format: %s"
     E044 = "[DBC-E044] Command not found in $PATH: %s"
+    E045 = "[DBC-E045] No Python Oracle driver available (python-oracledb or cx_Oracle), required for --backend driver"
+    E046 = "[DBC-E046] No running Oracle instances found (--multi-user)"
+    E047 = "[DBC-E047] Cannot merge %s: invalid ZIP entry %s"
+    E048 = "[DBC-E048] Cannot merge %s: %s"
+    E049 = "[DBC-E049] Cannot start collection for user %s: %s"
 
 class ErrorHelp():
     @classmethod
@@ -143,6 +158,24 @@ class ErrorHelp():
     W015 =  "No instance detection will be used, so dbcollect will skip any running instance that is not in the logons file."
     W016 =  "SQL*Plus returned an error when trying to connect. The next ORACLE_HOME will be attempted if available."
     W017 =  "This usually happens if the database is down (when using logins), or in the process of starting or shutting down, or when using the incorrect ORACLE_HOME."
+    W018 =  "An OS command did not complete within the command timeout and was killed. This can happen with commands like multipath or vgs on hosts with storage problems.\n\n" \
+            "Solution:\n\nNo action required, DBcollect will proceed normally. The timeout is recorded in the ZIP file. Use --cmd-timeout to allow more time."
+    W019 =  "The OS collection took longer than the total time budget, remaining commands are not executed.\n\n" \
+            "Solution:\n\nNo action required, DBcollect will proceed normally. Use --os-timeout to allow more time."
+    W020 =  "The metrics file for --metrics could not be written. Note that dbcollect switches to the oracle (or other) user when started as root.\n\n" \
+            "Solution:\n\nMake sure the directory (i.e. the node_exporter textfile directory) is writable for the dbcollect user. Collection proceeds normally."
+    W021 =  "With --multi-user, the dbcollect run for this Oracle user did not complete successfully. The results of the run (if any) are still merged,\n" \
+            "but the zip file is saved as .failed.zip. The logfile of the run is stored in the zip file as dbcollect-<user>.log (dbcollect.log for the first user).\n\n" \
+            "Solution:\n\nCheck the logfile of the run for errors."
+    W022 =  "An OS command timed out (see W018) but could not be stopped, for example a command run via sudo as root that ignores the termination signal.\n" \
+            "The command may keep running after dbcollect has finished.\n\n" \
+            "Solution:\n\nCheck for the process (pid) and kill it manually if needed. DBCollect will proceed normally."
+    W023 =  "The ZIP files to be merged both contain an entry with this name but with different contents, for example when the same instance\n" \
+            "or the OS info was collected in both runs. No data is lost, the entry from the later file is stored with the file label added to its name.\n\n" \
+            "Solution:\n\nNo action required. To avoid duplicates, collect each instance and the OS info only once (see --include, --no-sys)."
+    W024 =  "Some heavy dbinfo scripts have a row limit (dbinfo_limits in lib/config.py) to limit the size and run time on very large databases.\n" \
+            "A query of the script returned the maximum number of rows, the remaining rows are not collected. The header of the report has 'truncated' set.\n\n" \
+            "Solution:\n\nNo action required, the collection continues. The report is incomplete for databases with very many files or backups."
 
     E001 =  "This indicates an unexpected error in DBCollect due to a bug.\nSolution: Unknown, submit the logfile for debugging."
     E002 =  "DBCollect has been aborted, usually due to CTRL-C (cancel) keyboard sequence.\nSolution: restart dbcollect with the correct parameters."
@@ -245,3 +278,15 @@ class ErrorHelp():
             "The format for each line should be <user>/<password>//<hostname or fqdn>/<service>. For example: \n\n" \
             "dbsnmp/secret1234@//example.com/orcl\n\n"
     E044 =  "The listed command is not found in $PATH (/usr/sbin:/usr/bin:/bin:/sbin).\n\n"
+    E045 =  "The driver backend runs queries in-process and requires the python-oracledb or cx_Oracle module.\n\n" \
+            "Solution:\n\nInstall python-oracledb (pip install oracledb), or run without --backend to use SQL*Plus (default)"
+    E046 =  "--multi-user runs dbcollect for each owner of an Oracle instance (ora_pmon process), but no instances were found\n" \
+            "(or all were excluded with --include/--exclude).\n\n" \
+            "Solution:\n\nMake sure the databases are running, or run without --multi-user."
+    E047 =  "The ZIP file to be merged (--merge) is damaged, the data of the entry could not be read.\n\n" \
+            "Solution:\n\nCheck the file (unzip -t <file>), get the original file again or run dbcollect again."
+    E048 =  "Only dbcollect ZIP files (with the dbcollect comment) from the same host can be merged (--merge).\n\n" \
+            "Solution:\n\nMerge the files per host, or send the ZIP files separately."
+    E049 =  "With --multi-user, dbcollect starts itself again for each Oracle user, but starting the program failed.\n" \
+            "This happens if the dbcollect file is not executable or cannot be run directly (i.e. a ZIP file without the python line).\n\n" \
+            "Solution:\n\nMake sure dbcollect is executable (chmod 755) and runs as ./dbcollect, or use scripts/dbcollect-multi."
@@ -4,10 +4,14 @@ Copyright (c) 2024 - Bart Sjerps <bart@dirty-cache.com>
 License: GPLv3+
 """
 
-import os, sys, errno
+import os, sys, time, errno, signal, logging
 from subprocess import Popen, PIPE
+from threading import Thread
 from pkgutil import get_data
 
+from lib.errors import Errors, CommandTimeout
+from lib.replay import recording, replaying, record_command, replay_command
+
 def listdir(directory):
     """Return all files/dirs in dir, or empty list if not exists"""
     if not os.path.isdir(directory):
@@ -34,13 +38,32 @@ def getfile(*args):
                 continue
             raise
 
-def execute(cmd, **kwargs):
+def execute(cmd, timeout=None, outfile=None, **kwargs):
     """
     Run a command, and return the output of stdout. Any stderr messages will be logged.
     If the command fails (i.e. does not exists or exits with non-zero return code), logs an error
     Even if the command fails, still an empty string is returned so the program continues.
     kwargs are added to the environment variables (i.e. if ORACLE_HOME needs to be set)
+    If timeout (seconds) is given, the command (and its process group) is killed after the
+    timeout and CommandTimeout is raised.
+    If outfile (an open file) is given, stdout goes directly to the file and None is returned for stdout.
+    With --record the result is recorded, with --replay the recorded result is returned.
     """
+    if replaying():
+        return replay_command(cmd, timeout, outfile)
+    if not recording():
+        return run_command(cmd, timeout, outfile, **kwargs)
+    starttime = time.time()
+    try:
+        result = run_command(cmd, timeout, outfile, **kwargs)
+    except (CommandTimeout, OSError) as e:
+        record_command(cmd, time.time() - starttime, error=e)
+        raise
+    record_command(cmd, time.time() - starttime, result, outfile)
+    return result
+
+def run_command(cmd, timeout=None, outfile=None, **kwargs):
+    """Run a command, see execute()"""
     command = cmd.split(' ')
     env = {}
     env.update(kwargs)
@@ -49,11 +72,42 @@ def execute(cmd, **kwargs):
     env['ODMDIR'] = '/etc/objrepos'
     # Make ps -eo ... work on HPUX
     env['UNIX95'] = 'true'
+    # Run in a separate session (process group) so child processes can be killed on timeout.
+    # preexec_fn is not safe with threads (commands start from TaskPool threads), Python 2 has no alternative
+    stdout  = outfile or PIPE
     if sys.version_info[0] == 2:
-        proc = Popen(command, env=env, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        preexec = os.setsid if timeout is not None else None
+        proc = Popen(command, env=env, stdin=PIPE, stdout=stdout, stderr=PIPE, preexec_fn=preexec)
     else:
-        proc = Popen(command, env=env, stdin=PIPE, stdout=PIPE, stderr=PIPE, encoding='utf-8')
-    stdout, stderr = proc.communicate()
+        proc = Popen(command, env=env, stdin=PIPE, stdout=stdout, stderr=PIPE, start_new_session=timeout is not None, encoding='utf-8')
+    if timeout is None:
+        stdout, stderr = proc.communicate()
+        return (stdout, stderr, proc.returncode)
+
+    # communicate() in a helper thread so we can give up on it if killing does not close the pipes (i.e. sudo)
+    result = {}
+    def communicate():
+        result['output'] = proc.communicate()
+    thread = Thread(target=communicate)
+    thread.daemon = True
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError as e:
+            # With sudo the command runs as root and cannot be killed directly,
+            # terminate sudo itself which relays the signal to the command
+            logging.debug('Killing process group %s of %s failed (%s), terminating it', proc.pid, cmd, os.strerror(e.errno))
+            try:
+                proc.terminate()
+            except OSError as e:
+                logging.warning(Errors.W022, cmd, proc.pid, os.strerror(e.errno))
+        thread.join(5)
+        if thread.is_alive():
+            logging.warning(Errors.W022, cmd, proc.pid, 'still running')
+        raise CommandTimeout(Errors.W018, cmd, timeout)
+    stdout, stderr = result['output']
     return (stdout, stderr, proc.returncode)
 
 def sudosetup():
@@ -4,7 +4,7 @@ Copyright (c) 2024 - Bart Sjerps <bart@dirty-cache.com>
 License: GPLv3+
 """
 
-import sys, os, platform, logging, json, time
+import sys, os, platform, logging, json, time, shutil, tempfile
 from datetime import datetime
 
 try:
@@ -13,41 +13,57 @@ except ImportError:
     print("Error: No buildinfo")
     sys.exit(20)
 
-from lib.errors import Errors
+from lib.errors import Errors, CommandTimeout
 from lib.user import username, usergroup, usergroups, getuser, getgroup
 from lib.config import versioninfo
 from lib.functions import execute
+from lib.trace import record
+from lib.replay import replaying, record_event, replay_event, payload, text
 
 def get_timestamp(ts):
     """Workaround for strftime() not working (HP-UX)"""
     return '{0:04}-{1:02}-{2:02} {3:02}:{4:02}'.format(ts.year, ts.month, ts.day, ts.hour, ts.minute)
 
+hostinfo = {}
+
+def get_hostinfo():
+    """
+    Host identity, computed once per run
+    It is stored in meta.json only, other entries refer to it via the 'meta' field
+    """
+    if not hostinfo:
+        hostinfo['hostname']  = platform.uname()[1]  # Hostname
+        hostinfo['machine']   = platform.machine()   # x86_64 | sun4v | 00F6035A4C00 (AIX) | AMD64 etc...
+        hostinfo['system']    = platform.system()    # Linux  | SunOS | SunOS | AIX | Windows
+        hostinfo['processor'] = platform.processor() # x86_64 | i386 | sparc | powerpc | Intel64 Family ...
+    return hostinfo
+
 class JSONFile():
     """
     Container for a JSONPlus file
     JSONPlus file format is simply a JSON with the data of a command or file appended
     """
-    def __init__(self, cmd=None, path=None, sudo=False, **kwargs):
+    def __init__(self, cmd=None, path=None, sudo=False, timeout=None, **kwargs):
         self.info = {}
         self.info['application']  = 'dbcollect'
         self.info['version']      = versioninfo['version']
-        self.info['hostname']     = platform.uname()[1]  # Hostname
-        self.info['machine']      = platform.machine()   # x86_64 | sun4v | 00F6035A4C00 (AIX) | AMD64 etc...
-        self.info['system']       = platform.system()    # Linux  | SunOS | SunOS | AIX | Windows
-        self.info['processor']    = platform.processor() # x86_64 | i386 | sparc | powerpc | Intel64 Family ...
+        self.info['meta']         = 'meta.json'          # Host identity and UTC offset are in meta.json
         self.info['timestamp']    = get_timestamp(datetime.now())
-        self.info['timestamputc'] = get_timestamp(datetime.utcnow())
         self.info.update(kwargs)
         self.errors = None
         self.data   = None
+        self.spool  = None # Open binary file with the data, instead of self.data (large outputs)
         if cmd:
-            self.execute(cmd, sudo)
+            self.execute(cmd, sudo, timeout)
         elif path:
             self.readfile(path)
         self.info.update(kwargs)
 
     def meta(self):
         """Set default metadata fields"""
+        self.info.update(get_hostinfo())
+        self.info['timestamputc'] = get_timestamp(datetime.utcnow())
+        del self.info['meta']
         runinfo = {}
         runinfo['python']      = platform.python_version()
         runinfo['timezone']    = time.strftime("%Z", time.gmtime())           # The system's configured timezone
@@ -63,16 +79,23 @@ class JSONFile():
         """Setter for any kind of metric"""
         self.info[name] = val
 
-    def execute(self, cmd, sudo=False, **kwargs):
+    def execute(self, cmd, sudo=False, timeout=None, **kwargs):
         """
         Execute a command and return the output with the header.
         Forward kwargs to the execute function (extra env variables)
-        Also record status and errors
+        Also record status and errors. A timeout of 0 means the time budget
+        is used up, the command is not executed.
         """
         self.info['mediatype'] = 'command'
         self.info['format']    = 'text'
         self.info['command']   = cmd
-        out, err = None, None
+        out, err  = None, None
+        starttime = time.time()
+        if timeout is not None and timeout <= 0:
+            logging.warning(Errors.W019, cmd)
+            self.info['status'] = 'SKIPPED'
+            self.errors         = 'OS collection time budget exceeded'
+            return
         if sudo is True:
             if not os.path.exists('/usr/bin/sudo'):
                 self.info['status'] = 'ERROR'
@@ -82,15 +105,25 @@ class JSONFile():
             self.info['sudo'] = True
             self.info['fullcommand'] = cmd
         try:
-            out, err, rc = execute(cmd, **kwargs)
-            self.data   = out
+            # stdout is spooled to an anonymous temp file, so large outputs are not held in memory
+            self.spool  = tempfile.TemporaryFile()
+            out, err, rc = execute(cmd, timeout=timeout, outfile=self.spool, **kwargs)
             self.errors = err
             self.info['status']     = 'OK'
             self.info['returncode'] = rc
+            self.info['elapsed']    = round(time.time() - starttime, 3)
+            self.info['size']       = os.fstat(self.spool.fileno()).st_size
+        except CommandTimeout as e:
+            logging.warning(*e.args)
+            self.info['status']     = 'TIMEOUT'
+            self.info['timeout']    = timeout
+            self.errors             = 'Timeout after {0} seconds'.format(timeout)
+            self.info['returncode'] = None
         except OSError as e:
             self.info['status']     = 'ERROR'
             self.errors             = os.strerror(e.errno)
             self.info['returncode'] = None
+        record('command', starttime, time.time() - starttime, job=cmd, bytes=self.info.get('size'), status=self.info['status'])
 
     def readfile(self, path):
         """
@@ -100,6 +133,25 @@ class JSONFile():
         self.info['mediatype'] = 'flatfile'
         self.info['format']    = 'raw'
         self.info['path']      = path
+        if replaying():
+            event = replay_event('file', path)
+            if event is None:
+                self.info['status'] = 'Nonexistent'
+                return
+            self.info.update(event['info'])
+            self.errors = event['errors']
+            self.data   = text(payload(event, 'data'))
+            return
+        starttime = time.time()
+        self.loadfile(path)
+        info = {}
+        for key in ('status', 'size', 'mode', 'user', 'group', 'atime', 'mtime'):
+            if key in self.info:
+                info[key] = self.info[key]
+        record_event('file', path, time.time() - starttime, { 'data': self.data }, info=info, errors=self.errors)
+
+    def loadfile(self, path):
+        """Read the file and its attributes, see readfile()"""
         if not os.path.isfile(path):
             logging.debug('%s: No such file or directory', path)
             self.info['status'] = 'Nonexistent'
@@ -123,17 +175,21 @@ class JSONFile():
             self.info['status'] = 'Critical Error'
             logging.critical(Errors.E015, path, e)
 
-    def dbinfo(self, instance, name, path):
+    def dbinfo(self, instance, name, path, fmt='sqlplus'):
         """
         Create a dbinfo report
+        fmt is the output format of the backend session (sqlplus or csv)
+        Without path, only the header is created (i.e. a reference to another report)
         """
         self.info['mediatype'] = 'dbinfo'
-        self.info['format']    = 'sqlplus'
+        self.info['format']    = fmt
         self.info['script']    = name
         self.info['oracle']    = instance.meta
+        if path is None:
+            return
         try:
-            with open(path) as f:
-                self.data = f.read()
+            # Keep the spool file open, the data remains available after unlink
+            self.spool = open(path, 'rb')
             os.unlink(path)
         except Exception as e:
             self.info['status'] = 'ERROR'
@@ -165,17 +221,49 @@ class JSONFile():
         """Return the data as JSON text"""
         return json.dumps(self.info, indent=2, sort_keys=True)
 
+    def header(self):
+        """Return the JSON header of the JSONPlus file, including the newline if data follows"""
+        if self.errors:
+            self.info['errors'] = self.errors.splitlines()
+        header = json.dumps(self.info, indent=2, sort_keys=True)
+        if self.spool is not None:
+            if os.fstat(self.spool.fileno()).st_size:
+                header += '\n'
+        elif self.data:
+            header += '\n'
+        return header
+
+    def write(self, archive, tag):
+        """Write as JSONPlus to the archive, spooled data is copied in chunks"""
+        if self.spool is None:
+            archive.writestr(tag, self.jsonp())
+            return
+        archive.writefile(tag, self.header(), self.spool)
+        self.spool.close()
+        self.spool = None
+
     def save(self, path):
         """Save self as jsonp file"""
-        with open(path, 'w') as f:
-            f.write(self.jsonp())
+        if self.spool is None:
+            with open(path, 'w') as f:
+                f.write(self.jsonp())
+            return
+        with open(path, 'wb') as f:
+            f.write(self.header().encode('utf-8'))
+            self.spool.seek(0)
+            shutil.copyfileobj(self.spool, f, 65536)
+        self.spool.close()
+        self.spool = None
 
     def jsonp(self):
         """Return the data as JSONPlus"""
-        if self.errors:
-            self.info['errors'] = self.errors.splitlines()
-        data = json.dumps(self.info, indent=2, sort_keys=True)
-        if self.data:
-            data += '\n'
+        data = self.header()
+        if self.spool is not None:
+            self.spool.seek(0)
+            if sys.version_info[0] == 2:
+                data += self.spool.read()
+            else:
+                data += self.spool.read().decode('utf-8', 'replace')
+        elif self.data:
             data += self.data
         return data
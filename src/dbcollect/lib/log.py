@@ -13,6 +13,7 @@ logsetup must be called AFTER switching users, or strange things will happen.
 """
 
 import sys, logging
+from contextlib import contextmanager
 from lib.errors import Errors
 
 class TracebackInfoFilter(logging.Filter):
@@ -51,6 +52,22 @@ def logsetup(args, logpath):
 
     logging.getLogger().addHandler(consoleHandler)
 
+@contextmanager
+def forklock():
+    """
+    Hold the logging handler locks while starting a (forked) process
+    If another thread (i.e. OS collection) holds a handler lock at the moment of the fork,
+    the child would inherit a lock that is never released and hang on its first log message.
+    """
+    handlers = list(logging.getLogger().handlers)
+    for handler in handlers:
+        handler.acquire()
+    try:
+        yield
+    finally:
+        for handler in reversed(handlers):
+            handler.release()
+
 def exception_handler(func):
     """Decorator to catch CTRL-C and other exceptions (multiprocessing)
     This prevents a mess of error messages from different processes
@@ -0,0 +1,100 @@
+"""
+metrics.py - Run metrics for DBCollect (--metrics)
+Copyright (c) 2024 - Bart Sjerps <bart@dirty-cache.com>
+License: GPLv3+
+
+Writes run metrics in Prometheus text format, for the node_exporter textfile collector.
+The file is written periodically during the run and once more at the end. It is replaced
+atomically (write to a temp file in the same directory, then rename), so node_exporter
+never reads a partial file. Metrics are updated from the main process only.
+"""
+
+import os, time, logging
+from threading import Lock
+
+from lib.config import settings
+from lib.errors import Errors
+
+# name: (type, help)
+descriptions = {
+    'dbcollect_info':                     ('gauge',   'DBCollect version info'),
+    'dbcollect_run_start_time_seconds':   ('gauge',   'Start time of the run (unix time)'),
+    'dbcollect_run_duration_seconds':     ('gauge',   'Elapsed time of the run'),
+    'dbcollect_run_completed':            ('gauge',   '1 if the run has ended, 0 while running'),
+    'dbcollect_run_success':              ('gauge',   '1 if the run completed succesfully'),
+    'dbcollect_archive_size_bytes':       ('gauge',   'Size of the ZIP file'),
+    'dbcollect_reports_per_second':       ('gauge',   'AWR/Statspack reports per second'),
+    'dbcollect_reports_planned':          ('gauge',   'AWR/Statspack reports to be generated'),
+    'dbcollect_reports_total':            ('counter', 'AWR/Statspack reports stored in the ZIP file'),
+    'dbcollect_report_bytes_total':       ('counter', 'Bytes of AWR/Statspack reports stored in the ZIP file'),
+    'dbcollect_queue_wait_seconds_total': ('counter', 'Time SQL*Plus workers waited for jobs'),
+    'dbcollect_worker_failures_total':    ('counter', 'SQL*Plus workers that ended with an error'),
+}
+
+metrics = { 'path': None, 'lastwrite': 0, 'values': {}, 'lock': Lock() }
+
+def metrics_setup(path, **labels):
+    """Enable metrics and set the run info"""
+    metrics['path'] = path
+    metric_set('dbcollect_info', 1, **labels)
+    metric_set('dbcollect_run_start_time_seconds', round(time.time(), 3))
+    metric_set('dbcollect_run_completed', 0)
+    metric_set('dbcollect_run_success', 0)
+
+def metric_set(name, value, **labels):
+    """Set a metric (with optional labels) to value"""
+    key = (name, tuple(sorted(labels.items())))
+    with metrics['lock']:
+        metrics['values'][key] = value
+
+def metric_inc(name, value=1, **labels):
+    """Add value to a metric"""
+    key = (name, tuple(sorted(labels.items())))
+    with metrics['lock']:
+        metrics['values'][key] = metrics['values'].get(key, 0) + value
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def metrics_text():
+    """Return all metrics in Prometheus text format"""
+    with metrics['lock']:
+        values = sorted(metrics['values'].items())
+    start = metrics['values'].get(('dbcollect_run_start_time_seconds', ()))
+    if start:
+        values.append((('dbcollect_run_duration_seconds', ()), round(time.time() - start, 3)))
+        values.sort()
+    lines = []
+    prev  = None
+    for (name, labels), value in values:
+        if name != prev:
+            prev = name
+            mtype, mhelp = descriptions[name]
+            lines.append('# HELP {0} {1}'.format(name, mhelp))
+            lines.append('# TYPE {0} {1}'.format(name, mtype))
+        if labels:
+            labelstr = ','.join(['{0}="{1}"'.format(k, escape(v)) for k, v in labels])
+            lines.append('{0}{{{1}}} {2}'.format(name, labelstr, value))
+        else:
+            lines.append('{0} {1}'.format(name, value))
+    return '\n'.join(lines) + '\n'
+
+def metrics_write(force=False):
+    """Write the metrics file if the interval has passed (or force), no-op if metrics are disabled"""
+    path = metrics['path']
+    if not path:
+        return
+    if not force and time.time() - metrics['lastwrite'] < settings['metrics_interval']:
+        return
+    metrics['lastwrite'] = time.time()
+    tmppath = '{0}.{1}.tmp'.format(path, os.getpid())
+    try:
+        with open(tmppath, 'w') as f:
+            f.write(metrics_text())
+        os.chmod(tmppath, 0o644)
+        os.rename(tmppath, path)
+    except (IOError, OSError) as e:
+        logging.warning(Errors.W020, path, e)
+        metrics['path'] = None
+        if os.path.exists(tmppath):
+            os.unlink(tmppath)
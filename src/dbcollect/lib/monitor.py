@@ -0,0 +1,173 @@
+"""
+monitor.py - Self-impact monitoring for DBCollect
+Copyright (c) 2024 - Bart Sjerps <bart@dirty-cache.com>
+License: GPLv3+
+
+A background thread samples the resources used by dbcollect itself and all its
+child processes (workers, SQL*Plus) from /proc, next to the host load:
+
+- cpu:         CPU used by dbcollect in the interval, % of one CPU
+- rss:         Resident memory of all dbcollect processes (bytes)
+- read_bytes:  Storage I/O by dbcollect processes in the interval (bytes)
+- write_bytes: Idem, written
+- procs:       Number of dbcollect processes
+- load1:       Host load average (1 minute)
+- host_cpu:    Host CPU busy % (all CPUs)
+
+CPU time of exited children is included via the cutime/cstime of their parent.
+The samples are stored in the archive as monitor.jsonl. Linux only.
+"""
+
+import os, json, time, logging, platform
+from threading import Thread, Event
+
+def readfile(path):
+    with open(path) as f:
+        return f.read()
+
+def proc_stat(pid):
+    """Return (ppid, cputicks, rss pages) for a process from /proc/<pid>/stat"""
+    data = readfile('/proc/{0}/stat'.format(pid))
+    # The command name (field 2) can have spaces, so split after the closing ')'
+    fields = data[data.rfind(')') + 2:].split()
+    ppid   = int(fields[1])
+    ticks  = sum([int(x) for x in fields[11:15]]) # utime, stime, cutime, cstime
+    return ppid, ticks, int(fields[21])
+
+def proc_io(pid):
+    """Return (read_bytes, write_bytes) for a process from /proc/<pid>/io"""
+    io = {}
+    for line in readfile('/proc/{0}/io'.format(pid)).splitlines():
+        key, _, val = line.partition(':')
+        io[key] = int(val)
+    return io.get('read_bytes', 0), io.get('write_bytes', 0)
+
+def host_cpu():
+    """Return (busy, total) ticks from /proc/stat"""
+    fields = [int(x) for x in readfile('/proc/stat').splitlines()[0].split()[1:]]
+    idle   = sum(fields[3:5]) # idle, iowait
+    return sum(fields) - idle, sum(fields)
+
+class Monitor(Thread):
+    """Sampler thread, call stop() at the end of the run to get the samples"""
+    def __init__(self, interval=5):
+        Thread.__init__(self, name='monitor')
+        self.daemon   = True
+        self.interval = interval
+        self.stopped  = Event()
+        self.samples  = []
+        self.pid      = os.getpid()
+        self.hz       = os.sysconf('SC_CLK_TCK')
+        self.pagesize = os.sysconf('SC_PAGE_SIZE')
+        self.prev_io  = {}
+
+    def processes(self):
+        """Return {pid: (ticks, rss pages)} for dbcollect and all its descendants"""
+        stats = {}
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                stats[int(entry)] = proc_stat(entry)
+            except (IOError, OSError, IndexError, ValueError):
+                # Process exited or no access
+                continue
+        children = {}
+        for pid, stat in stats.items():
+            children.setdefault(stat[0], []).append(pid)
+        tree = {}
+        pids = [self.pid]
+        while pids:
+            pid = pids.pop()
+            if pid in stats:
+                tree[pid] = stats[pid][1:]
+                pids += children.get(pid, [])
+        return tree
+
+    def io(self, pids):
+        """Return I/O bytes (read, write) by the processes since the previous sample"""
+        rd, wr = 0, 0
+        current = {}
+        for pid in pids:
+            try:
+                current[pid] = proc_io(pid)
+            except (IOError, OSError, ValueError):
+                continue
+            prev_rd, prev_wr = self.prev_io.get(pid, (0, 0))
+            rd += max(0, current[pid][0] - prev_rd)
+            wr += max(0, current[pid][1] - prev_wr)
+        self.prev_io = current
+        return rd, wr
+
+    def sample(self):
+        tree = self.processes()
+        rd, wr = self.io(tree.keys())
+        busy, total = host_cpu()
+        return {
+            'time':        time.time(),
+            'ticks':       sum([v[0] for v in tree.values()]),
+            'rss':         sum([v[1] for v in tree.values()]) * self.pagesize,
+            'read_bytes':  rd,
+            'write_bytes': wr,
+            'procs':       len(tree),
+            'load1':       float(readfile('/proc/loadavg').split()[0]),
+            'busy':        busy,
+            'total':       total,
+        }
+
+    def run(self):
+        try:
+            prev = self.sample()
+            while True:
+                self.stopped.wait(self.interval)
+                if self.stopped.is_set():
+                    break
+                cur = self.sample()
+                elapsed = cur['time'] - prev['time']
+                hostdelta = cur['total'] - prev['total']
+                self.samples.append({
+                    'time':        round(cur['time'], 3),
+                    'cpu':         round(max(0, 100.0 * (cur['ticks'] - prev['ticks']) / self.hz / elapsed), 2),
+                    'rss':         cur['rss'],
+                    'read_bytes':  cur['read_bytes'],
+                    'write_bytes': cur['write_bytes'],
+                    'procs':       cur['procs'],
+                    'load1':       cur['load1'],
+                    'host_cpu':    round(100.0 * (cur['busy'] - prev['busy']) / hostdelta, 2) if hostdelta else 0.0,
+                })
+                prev = cur
+        except Exception as e:
+            logging.debug('Monitor stopped: %s', e)
+
+    def stop(self):
+        """Stop sampling and return the samples as JSON lines"""
+        self.stopped.set()
+        self.join(self.interval + 5)
+        return ''.join([json.dumps(s, sort_keys=True) + '\n' for s in self.samples])
+
+    def summary(self):
+        """Log peak and average overhead"""
+        if not self.samples:
+            return
+        def stats(key):
+            values = [s[key] for s in self.samples]
+            return sum(values) / float(len(values)), max(values)
+        mb = 1048576.0
+        cpu_avg, cpu_max   = stats('cpu')
+        rss_avg, rss_max   = stats('rss')
+        load_avg, load_max = stats('load1')
+        host_avg, host_max = stats('host_cpu')
+        rd = sum([s['read_bytes'] for s in self.samples]) / mb
+        wr = sum([s['write_bytes'] for s in self.samples]) / mb
+        logging.info('Collector CPU avg {0:.1f}%, peak {1:.1f}% (of one CPU), RSS avg {2:.0f} MiB, peak {3:.0f} MiB, I/O read {4:.0f} MiB, write {5:.0f} MiB'.format(
+            cpu_avg, cpu_max, rss_avg / mb, rss_max / mb, rd, wr))
+        logging.info('Host CPU busy avg {0:.1f}%, peak {1:.1f}%, load avg {2:.2f}, peak {3:.2f}'.format(
+            host_avg, host_max, load_avg, load_max))
+
+def monitor_start(interval):
+    """Start the sampler thread (Linux only), returns the monitor or None"""
+    if platform.system() != 'Linux' or not os.path.isdir('/proc/self'):
+        return None
+    monitor = Monitor(interval)
+    monitor.start()
+    return monitor
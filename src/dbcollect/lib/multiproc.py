@@ -4,9 +4,9 @@ Copyright (c) 2024 - Bart Sjerps <bart@dirty-cache.com>
 License: GPLv3+
 """
 
-import os, tempfile
+import os, time, errno, fcntl, tempfile
 from shutil import rmtree
-from multiprocessing import Event, Queue
+from multiprocessing import Event, Queue, Value
 
 class Tempdir():
     """Temp directory class with subdirs, which cleans up the tempdir when it gets deleted"""
@@ -26,3 +26,49 @@ class Shared():
         self.tempdir   = tempdir
         self.jobs      = Queue(60)
         self.done      = Event()
+        self.queue_wait = Value('d', 0.0) # Total seconds workers waited for jobs
+
+class TaskSlots():
+    """
+    Host-wide task budget shared by concurrent dbcollect runs (--multi-user)
+    The slot directory has one file per task, a task holds an exclusive lock (lockf) on one of them.
+    lockf locks belong to the process, so a process holds at most one slot at a time.
+    Locks are released by the OS if a process dies. No-op without a slot directory.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.fd   = None
+
+    def acquire(self):
+        """Wait for a free slot"""
+        if not self.path:
+            return
+        slots = sorted(os.listdir(self.path))
+        while True:
+            for slot in slots:
+                # lockf (fcntl locks) works on all platforms, but needs a writable descriptor
+                fd = os.open(os.path.join(self.path, slot), os.O_RDWR)
+                try:
+                    fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    self.fd = fd
+                    return
+                except (IOError, OSError) as e:
+                    os.close(fd)
+                    if e.errno not in (errno.EWOULDBLOCK, errno.EAGAIN, errno.EACCES):
+                        raise
+            time.sleep(0.2)
+
+    def release(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+def slots_setup(count):
+    """Create a slot directory for count tasks, the slots are writable for all users"""
+    path = tempfile.mkdtemp(prefix='dbcollect_slots_')
+    os.chmod(path, 0o755)
+    for n in range(count):
+        with open(os.path.join(path, 'slot{0:03d}'.format(n)), 'w'):
+            pass
+        os.chmod(os.path.join(path, 'slot{0:03d}'.format(n)), 0o666)
+    return path
@@ -0,0 +1,127 @@
+"""
+profiler.py - Profiling support for DBCollect (--profile)
+Copyright (c) 2024 - Bart Sjerps <bart@dirty-cache.com>
+License: GPLv3+
+
+cProfile only profiles the thread (and process) where it is enabled, so the main
+process, worker processes and threads each run their own Profiler and save the
+statistics in a shared directory. At the end of the run these are merged into
+one pstats file plus a text summary. Most of the run time is spent waiting on
+SQL*Plus or OS commands, which adds no profiling overhead.
+
+Worker processes are forked while the main profiler is active. The child stops the
+inherited profiler before starting its own (Python 3.12+ allows only one active
+profiler per process), its data belongs to the parent and is not saved.
+"""
+
+import os, tempfile, pstats, logging
+from shutil import rmtree
+
+try:
+    import cProfile as profile
+except ImportError:
+    import profile
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+profiledir = { 'path': None, 'main': None, 'pid': None }
+
+class Profiler():
+    """
+    Profile code with cProfile if profiling is enabled (no-op otherwise)
+    Statistics are saved as <name>_<pid>_<n>.prof in the profile directory
+    """
+    def __init__(self, name):
+        self.name = name
+        self.prof = None
+
+    def start(self):
+        if profiledir['path']:
+            inherited_stop()
+            try:
+                self.prof = profile.Profile()
+                self.prof.enable()
+            except ValueError as e:
+                # Python 3.12+ allows only one active profiler, which then covers all threads
+                logging.debug('Profiling %s not started: %s', self.name, e)
+                self.prof = None
+        return self
+
+    def stop(self):
+        if self.prof is None:
+            return
+        self.prof.disable()
+        path = os.path.join(profiledir['path'], '{0}_{1}_{2}.prof'.format(self.name, os.getpid(), id(self)))
+        try:
+            self.prof.dump_stats(path)
+        except (IOError, OSError) as e:
+            logging.debug('Saving profile %s failed: %s', path, e)
+        self.prof = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.stop()
+        return False
+
+def inherited_stop():
+    """In a forked child, stop the main profiler inherited from the parent process"""
+    main = profiledir['main']
+    if main is None or profiledir['pid'] == os.getpid():
+        return
+    if main.prof is not None:
+        main.prof.disable()
+        main.prof = None
+    profiledir['main'] = None
+
+def profiled(func):
+    """Decorator to run a function (worker process) under its own Profiler"""
+    def inner(*args, **kwargs):
+        with Profiler(func.__name__):
+            return func(*args, **kwargs)
+    return inner
+
+def profile_setup():
+    """Enable profiling for this run and start profiling the main thread"""
+    profiledir['path'] = tempfile.mkdtemp(prefix='dbcollect_profile_')
+    profiledir['pid']  = os.getpid()
+    profiledir['main'] = Profiler('main').start()
+
+def profile_merge():
+    """
+    Stop the main profiler and merge all saved statistics
+    Returns (path of the merged pstats file, text summary) or None if profiling is disabled.
+    The caller stores the file and removes it.
+    """
+    if not profiledir['path']:
+        return None
+    profiledir['main'].stop()
+    files = [os.path.join(profiledir['path'], f) for f in sorted(os.listdir(profiledir['path']))]
+    stats = None
+    for path in files:
+        try:
+            if stats is None:
+                stats = pstats.Stats(path)
+            else:
+                stats.add(path)
+        except Exception as e:
+            logging.debug('Reading profile %s failed: %s', path, e)
+    rmtree(profiledir['path'], ignore_errors=True)
+    profiledir['path'] = None
+    if stats is None:
+        return None
+
+    fd, merged = tempfile.mkstemp(prefix='dbcollect_profile_', suffix='.pstats')
+    os.close(fd)
+    stats.dump_stats(merged)
+
+    out = StringIO()
+    out.write('Profile statistics of {0} processes/threads\n'.format(len(files)))
+    stats.stream = out
+    stats.sort_stats('cumulative').print_stats(60)
+    stats.sort_stats('tottime').print_stats(40)
+    return merged, out.getvalue()
@@ -0,0 +1,208 @@
+"""
+replay.py - Record and replay of collection sessions (--record, --replay)
+Copyright (c) 2024 - Bart Sjerps <bart@dirty-cache.com>
+License: GPLv3+
+
+--record <file> saves every interaction with the outside world as an event:
+- OS commands (functions.execute): output, errors, returncode, timeouts
+- Flat files and sysfs attributes read by the OS collection
+- Backend calls: instance discovery, metadata scripts and session queries (input and spool output)
+
+A recording is a ZIP file with index.jsonl (one event per line: kind, key, elapsed time and
+results) and the payloads (outputs, file contents). Events are recorded from all processes:
+each process writes its payloads to the record directory and appends the event with a single
+os.write() on an O_APPEND descriptor, like lib/trace.py.
+
+--replay <file> returns the recorded results for the same kind and key in the recorded order,
+after waiting the recorded elapsed time, so the collection pipeline runs as on the original host.
+Other file access (SAR and NMON files, DMI and udev data) is not recorded.
+"""
+
+import os, sys, json, time, errno, shutil, tempfile, zlib
+from zipfile import ZipFile, ZIP_DEFLATED
+from threading import Lock
+
+from lib import errors
+from lib.errors import Errors, CommandTimeout
+
+state = {
+    'fd':     None,  # Index file descriptor (recording)
+    'dir':    None,  # Directory with payloads (recording)
+    'count':  0,
+    'path':   None,  # Recording (replay)
+    'zip':    None,
+    'zippid': None,
+    'events': None,  # { (kind, key): [events] } (replay)
+    'lock':   None,  # Per process, see lock()
+    'lockpid': None,
+}
+
+def lock():
+    """
+    Return the module lock, a new one in each (forked) process
+    The OS collection thread records events while the AWR workers are forked, a worker could
+    inherit the lock while it is held and would then hang on its first event.
+    """
+    if state['lockpid'] != os.getpid():
+        state['lock']    = Lock()
+        state['lockpid'] = os.getpid()
+    return state['lock']
+
+def recording():
+    return state['fd'] is not None
+
+def replaying():
+    return state['events'] is not None
+
+def checksum(text):
+    """Short checksum for use in keys"""
+    return '{0:08x}'.format(zlib.crc32((text or '').encode('utf-8')) & 0xffffffff)
+
+def record_setup():
+    """Start recording (main process only, before starting workers)"""
+    lock()
+    state['dir'] = tempfile.mkdtemp(prefix='dbcollect_record_')
+    os.mkdir(os.path.join(state['dir'], 'payloads'))
+    state['fd']  = os.open(os.path.join(state['dir'], 'index.jsonl'), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+
+def record_close(path):
+    """Stop recording and save the recording as ZIP file"""
+    if state['fd'] is None:
+        return
+    os.close(state['fd'])
+    state['fd'] = None
+    zf = ZipFile(path, 'w', ZIP_DEFLATED, allowZip64=True)
+    try:
+        zf.write(os.path.join(state['dir'], 'index.jsonl'), 'index.jsonl')
+        payloads = os.path.join(state['dir'], 'payloads')
+        for name in sorted(os.listdir(payloads)):
+            zf.write(os.path.join(payloads, name), 'payloads/' + name)
+    finally:
+        zf.close()
+    shutil.rmtree(state['dir'], ignore_errors=True)
+
+def record_event(kind, key, elapsed, payloads=None, **info):
+    """
+    Record an event, no-op if not recording
+    payloads maps names to data (str or bytes), an open file (copied from the start)
+    or ('path', <path>) to copy a file
+    """
+    if state['fd'] is None:
+        return
+    with lock():
+        state['count'] += 1
+        count = state['count']
+    event = { 'kind': kind, 'key': key, 'elapsed': round(elapsed, 3), 'pid': os.getpid(), 'payloads': {} }
+    event.update(info)
+    for name, data in (payloads or {}).items():
+        if data is None:
+            continue
+        filename = '{0}_{1}_{2}'.format(os.getpid(), count, name)
+        try:
+            with open(os.path.join(state['dir'], 'payloads', filename), 'wb') as f:
+                if isinstance(data, tuple):
+                    with open(data[1], 'rb') as src:
+                        shutil.copyfileobj(src, f, 65536)
+                elif hasattr(data, 'read'):
+                    data.seek(0)
+                    shutil.copyfileobj(data, f, 65536)
+                    data.seek(0, 2)
+                elif isinstance(data, bytes):
+                    f.write(data)
+                else:
+                    f.write(data.encode('utf-8'))
+        except (IOError, OSError):
+            continue
+        event['payloads'][name] = filename
+    line = json.dumps(event, sort_keys=True) + '\n'
+    try:
+        os.write(state['fd'], line.encode('utf-8'))
+    except OSError:
+        pass
+
+def record_error(kind, key, elapsed, e, **info):
+    """Record an exception so it is raised again on replay"""
+    if isinstance(e, (IOError, OSError)):
+        # Python 3 raises subclasses like FileNotFoundError
+        error = ['OSError', str(e.errno), e.strerror]
+    else:
+        error = [type(e).__name__] + [str(x) for x in e.args]
+    record_event(kind, key, elapsed, error=error, **info)
+
+def replay_setup(path):
+    """Load a recording for replay"""
+    lock()
+    state['path']   = path
+    state['events'] = {}
+    zf = ZipFile(path)
+    try:
+        index = zf.read('index.jsonl').decode('utf-8')
+    finally:
+        zf.close()
+    for line in index.splitlines():
+        event = json.loads(line)
+        state['events'].setdefault((event['kind'], event['key']), []).append(event)
+
+def replay_event(kind, key):
+    """
+    Return the next recorded event for kind and key after waiting the recorded elapsed time
+    Returns None if there is no such event. The last event for a key is repeated if needed.
+    Raises the recorded exception if the event failed.
+    """
+    with lock():
+        events = state['events'].get((kind, key))
+        if not events:
+            return None
+        event = events.pop(0) if len(events) > 1 else events[0]
+    time.sleep(event['elapsed'])
+    if 'error' in event:
+        name, args = event['error'][0], event['error'][1:]
+        if name == 'OSError':
+            code = int(args[0]) if args and args[0].isdigit() else errno.ENOENT
+            raise OSError(code, args[-1] if args else 'Not found')
+        raise getattr(errors, name, errors.CustomException)(*args)
+    return event
+
+def payload(event, name):
+    """Return a payload of a replayed event as bytes, None if not recorded"""
+    filename = event['payloads'].get(name)
+    if filename is None:
+        return None
+    with lock():
+        # Forked workers share the file offset of an inherited zip, so each process opens its own
+        if state['zippid'] != os.getpid():
+            state['zip']    = ZipFile(state['path'])
+            state['zippid'] = os.getpid()
+        return state['zip'].read('payloads/' + filename)
+
+def text(data):
+    """Payload bytes as str"""
+    if data is None or sys.version_info[0] == 2:
+        return data
+    return data.decode('utf-8', 'replace')
+
+def replay_command(cmd, timeout=None, outfile=None):
+    """Replay functions.execute(), returns (stdout, stderr, returncode)"""
+    event = replay_event('command', cmd)
+    if event is None:
+        raise OSError(errno.ENOENT, 'Command not recorded')
+    if event.get('timeout'):
+        raise CommandTimeout(Errors.W018, cmd, timeout)
+    stdout = payload(event, 'stdout') or b''
+    if outfile is not None:
+        outfile.write(stdout)
+        stdout = None
+    else:
+        stdout = text(stdout)
+    return stdout, text(payload(event, 'stderr')), event['returncode']
+
+def record_command(cmd, elapsed, result=None, outfile=None, error=None):
+    """Record the result (or error) of functions.execute()"""
+    if error is not None:
+        if isinstance(error, CommandTimeout):
+            record_event('command', cmd, elapsed, timeout=True)
+        else:
+            record_error('command', cmd, elapsed, error)
+        return
+    stdout, stderr, rc = result
+    record_event('command', cmd, elapsed, { 'stdout': outfile if outfile is not None else stdout, 'stderr': stderr }, returncode=rc)
@@ -0,0 +1,131 @@
+"""
+taskpool.py - Bounded thread pool for DBCollect
+Copyright (c) 2024 - Bart Sjerps <bart@dirty-cache.com>
+License: GPLv3+
+
+Runs independent tasks (usually OS commands) concurrently on a fixed number of threads.
+Each task gets a timeout, limited by what is left of the total time budget of the pool,
+so a single hanging command cannot block the whole collection.
+"""
+
+import time, logging
+from threading import Thread
+
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
+from lib.errors import Errors
+from lib.profiler import Profiler
+
+class TaskPool():
+    """
+    Thread pool with per-task timeouts and a total time budget
+    Tasks are callables that accept a timeout keyword argument (seconds, None=no limit).
+    A timeout of 0 means the budget is used up and the task should not run.
+    Commands run outside the pool that are needed to continue use command_timeout().
+    Results are returned in the calling thread, so only the caller writes to the archive.
+    """
+    def __init__(self, workers=4, timeout=None, budget=None, min_timeout=10):
+        self.workers      = max(1, workers)
+        self.task_timeout = timeout
+        self.min_timeout  = min_timeout
+        self.deadline     = time.time() + budget if budget else None
+        self.tasks        = Queue()
+        self.done         = Queue()
+        self.pending      = 0
+
+    def timeout(self):
+        """Return the timeout for a task starting now"""
+        if self.deadline is None:
+            return self.task_timeout
+        remaining = max(0, int(self.deadline - time.time()))
+        if self.task_timeout is None:
+            return remaining
+        return min(self.task_timeout, remaining)
+
+    def command_timeout(self):
+        """
+        Return the timeout for a command run in the calling thread (i.e. inventory commands)
+        Never less than min_timeout (or the task timeout if lower), also when the budget is used up
+        """
+        timeout = self.timeout()
+        if timeout is None:
+            return None
+        return max(timeout, min(self.min_timeout, self.task_timeout or self.min_timeout))
+
+    def submit(self, tag, func, *args, **kwargs):
+        """Add a task, it will run when results() is called"""
+        self.tasks.put((tag, func, args, kwargs))
+        self.pending += 1
+
+    def worker(self):
+        """Thread main loop, run tasks until the queue is empty"""
+        with Profiler('taskpool'):
+            self.run_tasks()
+
+    def run_tasks(self):
+        """Run tasks until the queue is empty"""
+        while True:
+            try:
+                tag, func, args, kwargs = self.tasks.get_nowait()
+            except Empty:
+                return
+            kwargs['timeout'] = self.timeout()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                logging.exception(Errors.E013, tag, e)
+                result = None
+            self.done.put((tag, result))
+
+    def results(self):
+        """Run the submitted tasks and yield (tag, result) in order of completion"""
+        threads = []
+        for _ in range(min(self.workers, self.pending)):
+            thread = Thread(target=self.worker)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        while self.pending:
+            try:
+                # Use a timeout so KeyboardInterrupt works on Python 2
+                yield self.done.get(True, 1)
+                self.pending -= 1
+            except Empty:
+                continue
+
+        for thread in threads:
+            thread.join()
+
+class BackgroundTask(Thread):
+    """
+    Run a function in a background thread
+    wait() returns the result, or raises the exception from the thread in the calling thread
+    """
+    def __init__(self, func, *args, **kwargs):
+        Thread.__init__(self, name=func.__name__)
+        self.daemon = True
+        self.func   = func
+        self.args   = args
+        self.kwargs = kwargs
+        self.result = None
+        self.error  = None
+        self.start()
+
+    def run(self):
+        try:
+            with Profiler(self.name):
+                self.result = self.func(*self.args, **self.kwargs)
+        except BaseException as e:
+            self.error = e
+
+    def wait(self):
+        while self.is_alive():
+            # Use a timeout so KeyboardInterrupt works on Python 2
+            self.join(1)
+        if self.error is not None:
+            raise self.error
+        return self.result
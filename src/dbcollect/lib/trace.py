@@ -0,0 +1,75 @@
+"""
+trace.py - Timing trace for DBCollect
+Copyright (c) 2024 - Bart Sjerps <bart@dirty-cache.com>
+License: GPLv3+
+
+Records spans (stage, sid, job, start, duration, bytes, status, pid) as JSON lines.
+The trace file is opened in the main process before any workers are started, so
+forked worker processes and threads inherit it and append to the same file.
+Each span is written with a single os.write() on an O_APPEND descriptor, so lines
+from different processes do not get mixed up.
+At the end of the run the file is stored in the archive as timings.jsonl.
+"""
+
+import os, json, time, tempfile
+
+tracefile = { 'fd': None, 'path': None }
+
+def trace_setup():
+    """Create the trace file (main process only)"""
+    fd, path = tempfile.mkstemp(prefix='dbcollect_timings_', suffix='.jsonl')
+    os.close(fd)
+    tracefile['fd']   = os.open(path, os.O_WRONLY | os.O_APPEND)
+    tracefile['path'] = path
+    return path
+
+def trace_close():
+    """Close the trace file and return the path, the caller stores and removes it"""
+    if tracefile['fd'] is not None:
+        os.close(tracefile['fd'])
+        tracefile['fd'] = None
+    return tracefile['path']
+
+def record(stage, start, duration, sid=None, job=None, bytes=None, status='OK', **kwargs):
+    """Write a span to the trace file (no-op if tracing is not set up)"""
+    if tracefile['fd'] is None:
+        return
+    span = {
+        'stage':    stage,
+        'sid':      sid,
+        'job':      job,
+        'start':    round(start, 3),
+        'duration': round(duration, 3),
+        'bytes':    bytes,
+        'status':   status,
+        'pid':      os.getpid(),
+    }
+    span.update(kwargs)
+    line = json.dumps(span, sort_keys=True) + '\n'
+    try:
+        os.write(tracefile['fd'], line.encode('utf-8'))
+    except OSError:
+        pass
+
+class Span():
+    """
+    Context manager that records a span for the enclosed code
+    Set bytes or status on the span inside the with block, an exception sets status ERROR
+    """
+    def __init__(self, stage, sid=None, job=None, **kwargs):
+        self.stage  = stage
+        self.sid    = sid
+        self.job    = job
+        self.bytes  = None
+        self.status = 'OK'
+        self.extra  = kwargs
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is not None and self.status == 'OK':
+            self.status = 'ERROR' if exc_type is not KeyboardInterrupt else 'INTERRUPTED'
+        record(self.stage, self.start, time.time() - self.start, self.sid, self.job, self.bytes, self.status, **self.extra)
+        return False
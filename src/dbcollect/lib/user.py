@@ -31,6 +31,26 @@ def dbuser():
             return user
     return None
 
+def dbusers():
+    """Return a list of (user, [sids]) for all Oracle database owners, in order of the pmon processes"""
+    stdout, _, _ = execute('ps -eo uid,args')
+    result = []
+    for uid, cmd in re.findall(r'(\d+)\s+(.*)', stdout):
+        r = re.match(r'ora_pmon_(\w+)', cmd)
+        if not r:
+            continue
+        try:
+            user = pwd.getpwuid(int(uid)).pw_name
+        except KeyError:
+            continue
+        for owner, sids in result:
+            if owner == user:
+                sids.append(r.group(1))
+                break
+        else:
+            result.append((user, [r.group(1)]))
+    return result
+
 def switchuser(user, args):
     """Call self as a different user with the same parameters"""
     if user is None:
@@ -23,25 +23,8 @@ except ImportError:
 
 _deleted = 'Section removed by awrstrip'
 
-def awrstrip(path, out=None, inplace=False):
-    """Strip a html formatted AWR report from sections containing SQL text.
-    The ADDM report is also removed as it also often contains SQL code.
-
-    Parameters:
-    path: file to be processed (must be valid html)
-    out: path to save file as (not saved if none)
-    inplace: save to same file if True
-
-    Returns:
-    None
-    """
-    if 'lxml' not in sys.modules:
-        logging.debug('python-lxml package not found, fallback to slower xml package')
-    try:
-        tree = etree.parse(path)
-    except etree.ParseError:
-        logging.error(Errors.E006, path)
-        return
+def strip_tree(tree):
+    """Replace the SQL and ADDM sections in a parsed AWR report, return True if anything changed"""
     blacklist = []
     try:
         tree_iter = tree.iter
@@ -61,12 +44,32 @@ def awrstrip(path, out=None, inplace=False):
             if element.text and element.text.strip().startswith('ADDM'):
                 #logging.debug('removing section "ADDM Report"')
                 blacklist.append(element)
-    changed = False
     for elem in blacklist:
-        changed = True
         elem.clear()
         elem.tag = 'h3'
         elem.text = _deleted
+    return len(blacklist) > 0
+
+def awrstrip(path, out=None, inplace=False):
+    """Strip a html formatted AWR report from sections containing SQL text.
+    The ADDM report is also removed as it also often contains SQL code.
+
+    Parameters:
+    path: file to be processed (must be valid html)
+    out: path to save file as (not saved if none)
+    inplace: save to same file if True
+
+    Returns:
+    None
+    """
+    if 'lxml' not in sys.modules:
+        logging.debug('python-lxml package not found, fallback to slower xml package')
+    try:
+        tree = etree.parse(path)
+    except etree.ParseError:
+        logging.error(Errors.E006, path)
+        return
+    changed = strip_tree(tree)
     if inplace is True:
         out = path
     if out and changed:
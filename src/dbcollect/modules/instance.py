@@ -6,9 +6,8 @@ License: GPLv3+
 
 import json, re, logging
 
-from lib.functions import getscript
 from lib.errors import Errors, ReportingError, SQLPlusError
-from lib.sqlplus import sqlplus
+from lib.trace import Span
 
 class Job():
     """AWR/Statspack job definition"""
@@ -22,6 +21,14 @@ class Job():
         self.begintime = begintime
         self.endtime   = endtime
 
+    @property
+    def key(self):
+        """
+        Identifies the report, the same for all instances or logons of the same database
+        Statspack snap ids are independent of AWR snap ids, so the report type is part of the key
+        """
+        return (self.reptype, self.dbid, self.instnum, self.beginsnap, self.endsnap)
+
     @property
     def filename(self):
         """Return the filename to be stored in the archive"""
@@ -39,15 +46,17 @@ class Job():
             dbid=self.dbid, inst=self.instnum, beginsnap=self.beginsnap, endsnap=self.endsnap)
 
 class Instance():
-    """Oracle Instance with SQL*Plus, scripts and other methods"""
-    def __init__(self, tempdir, sid, orahome, connectstring):
+    """Oracle Instance with query backend, scripts and other methods"""
+    def __init__(self, tempdir, sid, orahome, connectstring, backend):
+        self.backend   = backend
         self.tempdir   = tempdir
         self.sid       = sid
         self.orahome   = orahome
         self.connect   = connectstring
         self.jobs      = []
         self.scripts   = {}
-        self.meta_txt  = self.script('meta')
+        with Span('meta', sid):
+            self.meta_txt  = self.script('meta')
         try:
             # extract the json part (prevent glogin.sql problems)
             r    = re.match(r'.*?(^{.*?^})', self.meta_txt, re.M | re.S)
@@ -67,33 +76,23 @@ class Instance():
         self.spusage   = self.meta.pop('statspack', 0)
         self.cpus      = self.meta['cpus']
 
-    def sqlplus(self, quiet=False):
-        """Create SQL*Plus session and initialize with header"""
-        proc = sqlplus(self.orahome, self.sid, self.connect, self.tempdir, quiet=quiet)
-        proc.stdin.write("SET tab off feedback off verify off heading off lines 32767 pages 0 trims on\n")
-        proc.stdin.write("alter session set nls_date_language=american;\n")
-
-        # Handle Bug 19033356 - SQLPLUS WHENEVER OSERROR FAILS REGARDLESS OF OS COMMAND RESULT.
-        proc.stdin.write("whenever oserror continue;\n")
-
-        return proc
+    @property
+    def release(self):
+        """Oracle release as (major, minor), i.e. (12, 2)"""
+        try:
+            return tuple([int(x) for x in self.meta['version'].split('.')[:2]])
+        except (KeyError, ValueError):
+            return (self.version, 0)
 
     def script(self, name, header=None):
-        """Run SQL*Plus query and return the output. Log errors if they appear"""
-        sql = getscript(name + '.sql')
-        proc = self.sqlplus()
-        if header:
-            proc.stdin.write(header)
-        else:
-            proc.stdin.write("SET tab off feedback off verify off heading off lines 1000 pages 0 trims on\n")
-        out, _ = proc.communicate(sql)
-        if proc.returncode:
-            logging.debug('SQL*Plus output for query {0}.sql:\n{1}'.format(name, out))
-            raise SQLPlusError(Errors.E041, self.sid, proc.returncode)
-        return out.strip()
-
-    def get_jobs(self, args):
-        """Get the AWR or Statspack parameters and create jobs, return number of jobs"""
+        """Run a metadata script via the backend and return the output"""
+        return self.backend.script(self, name, header)
+
+    def get_jobs(self, args, registry=None):
+        """
+        Get the AWR or Statspack parameters and create jobs, return number of jobs
+        registry is a run-wide set of job keys, jobs already scheduled for another instance are skipped
+        """
         if args.no_awr:
             return 0
         if not self.status == 'OPEN':
@@ -125,19 +124,32 @@ class Instance():
         inc_rac  = '0' if args.no_rac  else '1'
         inc_stby = '0' if args.no_stby else '1'
         inc_pack = '1' if args.force_awr else '0'
-        header = 'define days = {0}\ndefine end_days = {1}\ndefine inc_rac = {2}\ndefine inc_stby = {3}\ndefine inc_pack = {4}\n'.format(args.days, args.end_days, inc_rac, inc_stby, inc_pack)
-        if reptype == 'awr':
-            data   = self.script('getawrs', header=header)
-        elif reptype == 'sp':
-            data   = self.script('getsps', header=header)
-        else:
-            raise ValueError('Bad reporttype', reptype)
+        rac_part = '1' if args.rac_partition else '0'
+        rac_sql  = '' if args.rac_partition else '--'
+        header = 'define days = {0}\ndefine end_days = {1}\ndefine inc_rac = {2}\ndefine inc_stby = {3}\ndefine inc_pack = {4}\ndefine rac_part = {5}\ndefine rac_sql = "{6}"\n'.format(args.days, args.end_days, inc_rac, inc_stby, inc_pack, rac_part, rac_sql)
+        with Span('getjobs', self.sid, reptype) as span:
+            if reptype == 'awr':
+                data   = self.script('getawrs', header=header)
+            elif reptype == 'sp':
+                data   = self.script('getsps', header=header)
+            else:
+                raise ValueError('Bad reporttype', reptype)
+            span.bytes = len(data)
+        duplicates = 0
         for line in data.splitlines():
             words = line.split(',')
             if not len(words) == 6:
                 continue
             job = Job(reptype, self.sid, *words)
+            if registry is not None:
+                if job.key in registry:
+                    logging.debug('{0}: Skipping duplicate job {1}'.format(self.sid, job.filename))
+                    duplicates += 1
+                    continue
+                registry.add(job.key)
             self.jobs.append(job)
+        if duplicates:
+            logging.info('{0}: Skipped {1} reports already scheduled for another instance'.format(self.sid, duplicates))
 
     @property
     def num_jobs(self):
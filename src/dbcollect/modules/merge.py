@@ -0,0 +1,67 @@
+"""
+merge.py - Merge dbcollect ZIP files (--merge)
+Copyright (c) 2025 - Bart Sjerps <bart@dirty-cache.com>
+License: GPLv3+
+
+Combines the ZIP files of separate runs on the same host (i.e. per user or per instance,
+see scripts/dbcollect-multi) into one dbcollect ZIP file before uploading.
+The compressed data is copied without recompression (Archive.merge), the hostname prefix
+and the dbcollect comment of the first file are preserved.
+"""
+
+import os, re, time, logging
+from zipfile import ZipFile, BadZipfile
+
+from lib.errors import Errors, CustomException
+from lib.archive import Archive
+
+def archive_comment(path):
+    """Return the comment and hostname of a dbcollect ZIP file"""
+    try:
+        zf = ZipFile(path)
+        try:
+            comment = zf.comment.decode('utf-8')
+        finally:
+            zf.close()
+    except (IOError, OSError) as e:
+        raise CustomException(Errors.E048, path, os.strerror(e.errno))
+    except BadZipfile:
+        raise CustomException(Errors.E048, path, 'not a ZIP file')
+    r = re.match(r'dbcollect version=\S+ hostname=(\S+)', comment)
+    if not r:
+        raise CustomException(Errors.E048, path, 'not a dbcollect ZIP file')
+    return comment, r.group(1)
+
+def merge(sources, filename, overwrite, split_size=None):
+    """Merge the sources into one dbcollect ZIP file, returns the exit code"""
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s : %(message)s')
+    try:
+        comment, hostname = archive_comment(sources[0])
+        for path in sources[1:]:
+            if archive_comment(path)[1] != hostname:
+                raise CustomException(Errors.E048, path, 'hostname is not {0}'.format(hostname))
+        if filename:
+            zippath = filename if filename.endswith('.zip') else filename + '.zip'
+        else:
+            zippath = 'dbcollect-{0}.zip'.format(hostname)
+        if os.path.realpath(zippath) in [os.path.realpath(path) for path in sources]:
+            raise CustomException(Errors.E048, zippath, 'target is one of the source files')
+
+        start   = time.time()
+        archive = Archive(zippath, overwrite, hostname=hostname, comment=comment, split_size=split_size)
+        try:
+            for path in sources:
+                logging.info('Merging %s', path)
+                label = os.path.splitext(os.path.basename(path))[0]
+                archive.merge(path, label)
+            archive.ok = True
+        finally:
+            archive.close()
+        elapsed = time.time() - start
+        logging.info('Zip file %s is created succesfully (%s MiB, %.1f MiB/s)', zippath if not split_size else zippath.replace('.zip', '.part*.zip'),
+            archive.size // 1048576, archive.size / 1048576.0 / max(elapsed, 0.001))
+        return 0
+
+    except CustomException as e:
+        logging.error(*e.args)
+        return 50
@@ -0,0 +1,143 @@
+"""
+multiuser.py - Parallel collection for multiple Oracle users (--multi-user)
+Copyright (c) 2025 - Bart Sjerps <bart@dirty-cache.com>
+License: GPLv3+
+
+SQL*Plus connects as sysdba via the OS user, so databases owned by different OS users
+each need a dbcollect run as that user (see scripts/dbcollect-multi). When started as root
+with --multi-user, dbcollect:
+
+- Finds the owners of the ora_pmon processes and their instances
+- Starts one dbcollect run per owner concurrently (--user <owner> --include <instances>).
+  Only the first run does the OS collection, the others run with --no-sys
+- Shares one host-wide task budget (--tasks) between the runs: each AWR/Statspack
+  report holds a slot while running (lib/multiproc.py, TaskSlots)
+- Merges the ZIP files of all runs into one dbcollect ZIP file
+"""
+
+import os, json, time, shutil, logging, platform
+from multiprocessing import cpu_count
+from subprocess import Popen
+
+from lib.config import settings
+from lib.log import logsetup
+from lib.errors import Errors, CustomException, ZipCreateError
+from lib.archive import Archive
+from lib.multiproc import slots_setup
+from lib.user import dbusers
+
+def task_budget(tasks):
+    """Host-wide number of tasks (same defaults as Instance.tasks, for the host cpus)"""
+    cpus = cpu_count()
+    if tasks == 0:
+        return cpus
+    elif tasks is None:
+        return max(1, min(8, cpus//2))
+    return min(max(1, tasks), cpus)
+
+def select_users(args):
+    """Return (user, [sids]) for the database owners, with --include and --exclude applied"""
+    include = args.include.split(',') if args.include else None
+    exclude = args.exclude.split(',') if args.exclude else []
+    result  = []
+    for user, sids in dbusers():
+        sids = [sid for sid in sids if (include is None or sid in include) and sid not in exclude]
+        if sids:
+            result.append((user, sids))
+    return result
+
+def multi_collect(args, cmdline, zippath, split_size=None):
+    """Run dbcollect for all Oracle users concurrently and merge the results, returns the exit code"""
+    logpath = settings['logpath']
+    logsetup(args, logpath)
+    logging.info('Multi-user collection, zip file is {0}'.format(zippath))
+
+    users = select_users(args)
+    if not users:
+        logging.error(Errors.E046)
+        return 20
+
+    hostname = platform.uname()[1]
+    budget   = task_budget(args.tasks)
+    slotdir  = slots_setup(budget)
+    archive  = None
+    runs     = []
+    try:
+        archive = Archive(zippath, args.overwrite, split_size=split_size)
+        logging.info('Host-wide task budget is {0} tasks'.format(budget))
+        syscollect = True
+        for user, sids in users:
+            part = os.path.join('/tmp', 'dbcollect-{0}.{1}.zip'.format(hostname, user))
+            cmd  = cmdline + ['--overwrite', '--quiet', '--user', user, '--include', ','.join(sids),
+                              '--filename', part, '--logfile', '/tmp/dbcollect-{0}.log'.format(user),
+                              '--tasks', str(budget), '--task-slots', slotdir, '--split-size', '0']
+            if not syscollect:
+                cmd.append('--no-sys')
+            logging.info('Starting collection for user {0} ({1}){2}'.format(user, ', '.join(sids), ', with OS collection' if syscollect else ''))
+            run = { 'user': user, 'sids': sids, 'part': part, 'proc': None, 'start': time.time() }
+            runs.append(run)
+            try:
+                run['proc'] = Popen(cmd, cwd='/tmp')
+            except OSError as e:
+                logging.error(Errors.E049, user, os.strerror(e.errno))
+                run['elapsed'] = 0
+                continue
+            # Only the first run that starts does the OS collection
+            syscollect = False
+
+        pending = [run for run in runs if run['proc']]
+        while pending:
+            time.sleep(1)
+            for run in list(pending):
+                rc = run['proc'].poll()
+                if rc is None:
+                    continue
+                pending.remove(run)
+                run['elapsed'] = round(time.time() - run['start'], 2)
+                run['returncode'] = rc
+                if rc == 0:
+                    logging.info('Collection for user {0} finished, elapsed time {1} seconds'.format(run['user'], run['elapsed']))
+                else:
+                    logging.warning(Errors.W021, run['user'], rc)
+
+        # Merge the results, the first run (with OS collection) keeps the original names
+        for run in runs:
+            for path in (run['part'], run['part'].replace('.zip', '.failed.zip')):
+                if os.path.isfile(path):
+                    logging.info('Merging {0}'.format(path))
+                    archive.merge(path, run['user'])
+                    os.unlink(path)
+        summary = [dict([(k, run.get(k)) for k in ('user', 'sids', 'returncode', 'elapsed')]) for run in runs]
+        archive.writestr('multiuser.json', json.dumps({ 'tasks': budget, 'runs': summary }, indent=2))
+        archive.ok = all([run.get('returncode') == 0 for run in runs])
+        if archive.ok:
+            logging.info('Zip file {0} is created succesfully.'.format(zippath if not split_size else zippath.replace('.zip', '.part*.zip')))
+        logging.info("Finished")
+
+    except KeyboardInterrupt:
+        logging.fatal(Errors.E002)
+        return 10
+
+    except CustomException as e:
+        logging.error(*e.args)
+        logging.info("Aborting")
+        return 50
+
+    finally:
+        # Never leave child runs behind (they also get the interrupt)
+        for run in runs:
+            if run['proc'] and run['proc'].poll() is None:
+                run['proc'].wait()
+        shutil.rmtree(slotdir, ignore_errors=True)
+        try:
+            if archive:
+                archive.store(logpath, 'dbcollect-multi.log')
+                archive.close()
+            if os.path.isfile(logpath):
+                os.unlink(logpath)
+        except ZipCreateError as e:
+            # The archive is incomplete (next part could not be created), keep the logfile
+            logging.error(*e.args)
+            logging.info('Logfile is {0}'.format(logpath))
+
+    return 0 if archive.ok else 50
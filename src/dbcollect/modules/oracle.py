@@ -10,7 +10,13 @@ from multiprocessing import Process
 
 from lib.errors import Errors, CustomException
 from lib.detect import get_instances
+from lib.backend import get_backend
 from lib.multiproc import Shared, Tempdir
+from lib.log import forklock
+from lib.taskpool import BackgroundTask
+from lib.trace import Span
+from lib.replay import record_event
+from lib.metrics import metric_set, metric_inc, metrics_write
 from .awrstrip import awrstrip
 from .instance import Instance
 from .workers import job_generator, job_processor, info_processor
@@ -23,15 +29,22 @@ def oracle_info(archive, args):
     instances  = []
     total_jobs = 0
     done_jobs  = 0
+    registry   = set() # Job keys of all instances, to skip duplicate reports
 
-    for sid, orahome, connectstring in get_instances(args):
-        instance = Instance(tempdir, sid, orahome, connectstring)
-        instance.get_jobs(args)
+    with Span('discovery') as span:
+        discovered = get_instances(args)
+    record_event('discover', 'instances', time.time() - span.start, result=discovered)
+
+    for sid, orahome, connectstring in discovered:
+        instance = Instance(tempdir, sid, orahome, connectstring, get_backend(args))
+        instance.get_jobs(args, registry)
         total_jobs += instance.num_jobs
+        metric_set('dbcollect_reports_planned', instance.num_jobs, instance=sid)
         logging.info('{0}: generating {1} workload reports'.format(sid, instance.num_jobs))
         instances.append(instance)
 
     msg = 'No reports'
+    dbscripts = {}
     starttime = time.time()
     for instance in instances:
         shared    = Shared(args, instance, tempdir)
@@ -40,14 +53,17 @@ def oracle_info(archive, args):
         awrdir    = os.path.join(tempdir, 'awr')
         workers   = []
 
-        info_processor(shared)
+        # DBInfo runs in a thread while the AWR workers run, results are written to the archive directly
+        dbinfo = BackgroundTask(info_processor, shared, archive, dbscripts)
 
         generator = Process(target=job_generator, name='Generator', args=(shared,))
-        generator.start()
+        with forklock():
+            generator.start()
         num_tasks = instance.tasks(args.tasks)
         for i in range(num_tasks):
             worker = Process(target=job_processor, name='Processor', args=(shared,i))
-            worker.start()
+            with forklock():
+                worker.start()
             workers.append(worker)
 
         logging.info('%s: Started %s SQLPlus sessions', shared.instance.sid, len(workers))
@@ -57,6 +73,8 @@ def oracle_info(archive, args):
             time.sleep(1)
             filelist = os.listdir(awrdir)
             working  = any([worker.is_alive() for worker in workers])
+            metric_set('dbcollect_queue_wait_seconds_total', round(shared.queue_wait.value, 3), instance=instance.sid)
+            metrics_write()
 
             # Break if no more files AND no more workers
             if not any((filelist, working)):
@@ -67,12 +85,18 @@ def oracle_info(archive, args):
 
                 # If requested, strip HTML file from SQL sections
                 if args.strip and filename.endswith('.html'):
-                    awrstrip(path, inplace=True)
+                    with Span('strip', instance.sid, filename) as span:
+                        awrstrip(path, inplace=True)
+                        span.bytes = os.path.getsize(path)
                     logging.debug('Stripped SQL code from {0}'.format(filename))
 
                 # Store the file and remove from FS
-                archive.store(path, 'oracle/{0}/'.format(instance.sid) + filename)
+                with Span('archive', instance.sid, filename) as span:
+                    span.bytes = os.path.getsize(path)
+                    archive.store(path, 'oracle/{0}/'.format(instance.sid) + filename)
                 os.unlink(path)
+                metric_inc('dbcollect_reports_total', instance=instance.sid)
+                metric_inc('dbcollect_report_bytes_total', span.bytes, instance=instance.sid)
 
                 # Housekeeping
                 done_jobs += 1
@@ -84,6 +108,7 @@ def oracle_info(archive, args):
                 eta_s      = timedelta(seconds=round(eta))
                 msg = 'Report {0} of {1} ({2:.1%} done), elapsed: {3}, remaining: {4}, reports/s: {5:.2f}'.format(
                         done_jobs, total_jobs, pct_done, elapsed_s, eta_s, rps)
+                metric_set('dbcollect_reports_per_second', round(rps, 3))
                 if args.quiet:
                     pass
                 elif args.debug:
@@ -103,6 +128,8 @@ def oracle_info(archive, args):
                 pass
             elif worker.exitcode:
                 logging.error(Errors.E022, worker.exitcode)
+            if worker.exitcode:
+                metric_inc('dbcollect_worker_failures_total', instance=instance.sid)
 
         logging.info('%s: Workers completed', instance.sid)
 
@@ -114,8 +141,9 @@ def oracle_info(archive, args):
         logging.debug('%s: Waiting for job generator', instance.sid)
         generator.join()
         logging.info('%s: Job generator completed', instance.sid)
+        dbinfo.wait()
 
-        # Pick up DBInfo and Log files
+        # Pick up leftover DBInfo spool files and Log files
         for filename in os.listdir(dbidir):
             path = os.path.join(dbidir, filename)
             archive.store(path, 'oracle/dbinfo/{0}'.format(filename))
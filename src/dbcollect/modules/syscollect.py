@@ -4,29 +4,181 @@ Copyright (c) 2024 - Bart Sjerps <bart@dirty-cache.com>
 License: GPLv3+
 """
 
-import os, re, platform, logging
-from lib.config import linux_config, aix_config, sunos_config, hpux_config
+import os, re, time, platform, logging
+from lib.config import settings, linux_config, aix_config, sunos_config, hpux_config
 from lib.jsonfile import JSONFile
 from lib.functions import execute, listdir
-from lib.errors import Errors
+from lib.taskpool import TaskPool
+from lib.trace import Span
+from lib.replay import replaying, record_event, replay_event
+from lib.errors import Errors, CommandTimeout
 
 # Check to continue even if platform is unknown?
 def host_info(archive, args):
     """Get OS and run the corresponding OS/SAR module"""
     system = platform.system()
     logging.info('Collecting OS info ({0})'.format(system))
-    if args.nmon:
-        nmon_info(archive, args)
-    if system == 'Linux':
-        linux_info(archive, args)
-    elif system == 'AIX':
-        aix_info(archive, args)
-    elif system == 'SunOS':
-        sun_info(archive, args)
-    elif system == 'HP-UX':
-        hpux_info(archive, args)
-    else:
-        logging.error(Errors.E008, system)
+    # Commands run concurrently, each with a timeout and a total budget for the OS collection
+    pool = TaskPool(settings['os_tasks'], args.cmd_timeout or None, args.os_timeout * 60 or None, settings['cmd_min_timeout'])
+    with Span('os'):
+        if args.nmon:
+            nmon_info(archive, args)
+        if system == 'Linux':
+            linux_info(archive, args, pool)
+        elif system == 'AIX':
+            aix_info(archive, args, pool)
+        elif system == 'SunOS':
+            sun_info(archive, args, pool)
+        elif system == 'HP-UX':
+            hpux_info(archive, args, pool)
+        else:
+            logging.error(Errors.E008, system)
+
+def run_commands(archive, pool, commands):
+    """Run (tag, command, sudo) commands on the pool and store the output as tag"""
+    for tag, cmd, sudo in commands:
+        pool.submit(tag, JSONFile, cmd=cmd, sudo=sudo)
+    for tag, df in pool.results():
+        if df is not None:
+            df.write(archive, tag)
+
+def inline_command(pool, cmd):
+    """
+    Run a command in the calling thread, with the command timeout of the pool
+    Returns (stdout, stderr, rc), rc is None if the command failed or timed out
+    """
+    try:
+        return execute(cmd, timeout=pool.command_timeout())
+    except CommandTimeout as e:
+        logging.warning(*e.args)
+        return '', 'Timeout', None
+    except OSError as e:
+        logging.warning(Errors.W005, cmd, e)
+        return '', os.strerror(e.errno), None
+
+def sysfs_read(directory, files, integers=()):
+    """
+    Read a list of sysfs attributes from a directory
+    Returns a dict with the basename of each file as key, None if the file cannot be read
+    """
+    key = '{0}:{1}'.format(directory, ','.join(files))
+    if replaying():
+        event = replay_event('sysfs', key)
+        return event['result'] if event else dict([(file.split('/')[-1], None) for file in files])
+    starttime = time.time()
+    info = {}
+    for file in files:
+        var = file.split('/')[-1]
+        try:
+            with open(os.path.join(directory, file)) as f:
+                data = f.read().strip()
+            info[var] = int(data) if var in integers else data
+        except (IOError, OSError, ValueError):
+            info[var] = None
+    record_event('sysfs', key, time.time() - starttime, result=info)
+    return info
+
+def udev_exportdb(text):
+    """
+    Parse the output of 'udevadm info --export-db'
+    Returns { devname: (symlinks, properties) } for all block devices
+    Symlinks are relative to /dev, like 'udevadm info -q symlink' prints them
+    """
+    udevinfo = {}
+    for record in re.split(r'\n\s*\n', text):
+        name, symlinks, properties = None, [], {}
+        for line in record.splitlines():
+            key, _, value = line.partition(': ')
+            if key == 'N':
+                name = value
+            elif key == 'S':
+                symlinks.append(value)
+            elif key == 'E':
+                k, _, v = value.partition('=')
+                properties[k] = v
+        if name and properties.get('SUBSYSTEM') == 'block':
+            udevinfo[name] = (symlinks, properties)
+    return udevinfo
+
+def udev_rundata(devices):
+    """
+    Build udev info from the udev database files in /run/udev/data (b<major>:<minor>)
+    The kernel properties are taken from sysfs uevent, like udevadm does
+    """
+    udevinfo = {}
+    for dev in devices:
+        sysdir = os.path.join('/sys/class/block', dev)
+        properties = {}
+        try:
+            with open(os.path.join(sysdir, 'uevent')) as f:
+                for line in f:
+                    k, _, v = line.strip().partition('=')
+                    properties[k] = v
+        except (IOError, OSError):
+            continue
+        properties['DEVPATH'] = os.path.realpath(sysdir)[4:]
+        properties['DEVNAME'] = '/dev/' + properties.get('DEVNAME', dev)
+        properties['SUBSYSTEM'] = 'block'
+        symlinks = []
+        path = '/run/udev/data/b{0}:{1}'.format(properties.get('MAJOR'), properties.get('MINOR'))
+        try:
+            with open(path) as f:
+                for line in f:
+                    key, _, value = line.rstrip('\n').partition(':')
+                    if key == 'S':
+                        symlinks.append(value)
+                    elif key == 'E':
+                        k, _, v = value.partition('=')
+                        properties[k] = v
+                    elif key == 'I':
+                        properties['USEC_INITIALIZED'] = value
+        except (IOError, OSError):
+            pass
+        if symlinks:
+            # Like 'udevadm info -q property': DEVLINKS has full paths, symlinks are relative to /dev
+            properties['DEVLINKS'] = ' '.join(['/dev/' + link for link in symlinks])
+        udevinfo[dev] = (symlinks, properties)
+    return udevinfo
+
+def udev_info(devices, pool):
+    """
+    Get udev symlinks and properties for all block devices in one pass
+    Uses a single 'udevadm info --export-db' and falls back to /run/udev/data.
+    Returns (udevinfo, udevcmd) where udevcmd holds the command result if udevadm failed
+    """
+    cmd = 'udevadm info --export-db'
+    try:
+        out, err, rc = execute(cmd, timeout=pool.command_timeout())
+        if rc == 0:
+            return udev_exportdb(out), None
+        udevcmd = { 'command': cmd, 'stdout': '', 'stderr': err, 'rc': rc }
+    except CommandTimeout as e:
+        logging.warning(*e.args)
+        udevcmd = { 'command': cmd, 'stdout': '', 'stderr': 'Timeout', 'rc': None }
+    except OSError as e:
+        logging.warning(Errors.W005, cmd, e)
+        udevcmd = { 'command': cmd, 'stdout': '', 'stderr': os.strerror(e.errno), 'rc': None }
+    if os.path.isdir('/run/udev/data'):
+        return udev_rundata(devices), None
+    return {}, udevcmd
+
+def in_window(path, args):
+    """
+    Check if a daily SAR or NMON file overlaps the --days/--end_days collection window
+    The file is written until the end of the period it covers, so the mtime marks the end
+    of the period and mtime - 1 day (approximately) the start.
+    """
+    now   = time.time()
+    start = now - args.days * 86400
+    end   = now - args.end_days * 86400
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return False
+    if mtime >= start and mtime - 86400 <= end:
+        return True
+    logging.debug('Skipping %s (outside collection window)', path)
+    return False
 
 def nmon_info(archive, args):
     """Get NMON reports"""
@@ -41,6 +193,8 @@ def nmon_info(archive, args):
             continue
         for file in listdir(nmondir):
             path = os.path.join(nmondir, file)
+            if not in_window(path, args):
+                continue
             with open(path) as f:
                 buf = f.read(12)
                 if buf != 'AAA,progname':
@@ -48,8 +202,8 @@ def nmon_info(archive, args):
                     continue
             archive.store(path)
 
-def sar_info(archive, args):
-    """Get UNIX SAR reports"""
+def sar_info(archive, args, pool):
+    """Get UNIX SAR reports, the sar commands for all files run concurrently on the pool"""
     if args.no_sar:
         return
     logging.info('Collecting UNIX SAR reports')
@@ -58,34 +212,29 @@ def sar_info(archive, args):
     sarinfo.dir(sarpath)
     archive.writestr('sarinfo.json', sarinfo.dump())
 
+    commands = []
     for sarfile in listdir(sarpath):
         path = os.path.join(sarpath, sarfile)
         if sarfile.startswith('sar'):
             continue
-        if sarfile.startswith('sa'):
-            df_cpu   = JSONFile(cmd='sar -uf {0}'.format(path))
-            df_block = JSONFile(cmd='sar -bf {0}'.format(path))
-            df_disk  = JSONFile(cmd='sar -df {0}'.format(path))
-            df_swap  = JSONFile(cmd='sar -rf {0}'.format(path))
-            archive.writestr('sar/{0}_{1}.jsonp'.format(sarfile, 'cpu'), df_cpu.jsonp())
-            archive.writestr('sar/{0}_{1}.jsonp'.format(sarfile, 'block'), df_block.jsonp())
-            archive.writestr('sar/{0}_{1}.jsonp'.format(sarfile, 'disk'), df_disk.jsonp())
-            archive.writestr('sar/{0}_{1}.jsonp'.format(sarfile, 'swap'), df_swap.jsonp())
-
-def linux_info(archive, args):
+        if sarfile.startswith('sa') and in_window(path, args):
+            for metric, flag in (('cpu','u'), ('block','b'), ('disk','d'), ('swap','r')):
+                tag = 'sar/{0}_{1}.jsonp'.format(sarfile, metric)
+                commands.append((tag, 'sar -{0}f {1}'.format(flag, path), False))
+    run_commands(archive, pool, commands)
+
+def linux_info(archive, args, pool):
     """System/SAR info for Linux"""
     info = {}
     for cmd in ('sestatus','uptime'):
-        try:
-            out, err, rc = execute(cmd)
-            if rc != 0:
-                info['{0}_error'.format(cmd)] = { 'command': cmd, 'stdout': out, 'stderr': err, 'rc': rc }
-            if cmd == 'sestatus':
-                out = out.split()[-1]
-            info[cmd] = out.strip()
-
-        except OSError as e:
-            logging.warning(Errors.W005, cmd, e)
+        out, err, rc = inline_command(pool, cmd)
+        if rc is None:
+            continue
+        if rc != 0:
+            info['{0}_error'.format(cmd)] = { 'command': cmd, 'stdout': out, 'stderr': err, 'rc': rc }
+        if cmd == 'sestatus':
+            out = out.split()[-1]
+        info[cmd] = out.strip()
 
     try:
         for file in os.listdir('/sys/class/dmi/id'):
@@ -111,29 +260,19 @@ def linux_info(archive, args):
     # powerpath / scaleio? -> Need root?
 
     disklist = []
-    out, err, rc = execute('lsblk -dno name')
-    for dev in out.rstrip().splitlines():
+    out, err, rc = inline_command(pool, 'lsblk -dno name')
+    devices = out.rstrip().splitlines()
+    udevinfo, udevcmd = udev_info(devices, pool)
+    for dev in devices:
         info = { 'name': dev, 'properties': {} }
-        for file in  ['dev', 'device/model','device/rev','device/queue_depth','device/vendor','device/serial','size','queue/scheduler']:
-            path = os.path.join('/sys/class/block/{0}/{1}'.format(dev, file))
-            var = file.split('/')[-1]
-            try:
-                with open(path) as f:
-                    data = f.read().strip()
-                    if var in ('queue_depth','size'):
-                        data = int(data)
-                    info[var] = data
-            except IOError as e:
-                info[var] = None
-        cmd = 'udevadm info -q symlink -n {0}'.format(dev)
-        out, err, rc = execute(cmd)
-        if rc != 0:
-            info['udevadm_cmd'] = { 'command': cmd, 'stdout': out, 'stderr': err, 'rc': rc }
-        info['symlinks'] = out.split()
-        cmd = 'udevadm info -q property -n {0}'.format(dev)
-        out, err, rc = execute(cmd)
-        for k, v in re.findall(r'^(\S+)=(.*)', out, re.M):
-            info['properties'][k] = v
+        info.update(sysfs_read('/sys/class/block/{0}'.format(dev),
+            ['dev', 'device/model','device/rev','device/queue_depth','device/vendor','device/serial','size','queue/scheduler'],
+            ('queue_depth','size')))
+        if udevcmd:
+            info['udevadm_cmd'] = udevcmd
+        symlinks, properties = udevinfo.get(dev, ([], {}))
+        info['symlinks'] = symlinks
+        info['properties'].update(properties)
         disklist.append(info)
 
     diskinfo = JSONFile()
@@ -144,41 +283,32 @@ def linux_info(archive, args):
     for dev in listdir('/sys/class/net'):
         if dev == 'lo':
             continue
-        info = { 'name': dev }
         directory = os.path.join('/sys/class/net', dev)
         if not os.path.isdir(directory):
             continue
-        for var in ['mtu', 'speed', 'address','duplex']:
-            path = os.path.join(directory, var)
-            try:
-                with open(path) as f:
-                    data = f.read().rstrip()
-                    if var in ('mtu','speed'):
-                        data = int(data)
-                    info[var] = data
-            except  (IOError, OSError) as e:
-                info[var] = None
+        info = { 'name': dev }
+        info.update(sysfs_read(directory, ['mtu', 'speed', 'address','duplex'], ('mtu','speed')))
         niclist.append(info)
 
     nicinfo = JSONFile()
     nicinfo.set('nicinfo', {'niclist': niclist} )
     archive.writestr('nicinfo.json', nicinfo.dump())
 
-    out, err, rc = execute('lsblk -V')
-    lsblk_version = (out + err).split()[-1]
+    out, err, rc = inline_command(pool, 'lsblk -V')
+    lsblk_version = (out + err).split()[-1] if rc is not None else ''
 
+    commands = []
     for tag, cmd in linux_config['commands'].items():
         if tag == 'lsblk_long' and lsblk_version.startswith('2.1'):
             continue
         if tag == 'lsblk_el6' and not lsblk_version.startswith('2.1'):
             continue
-
-        df = JSONFile(cmd=cmd)
-        archive.writestr('cmd/{0}.jsonp'.format(tag), df.jsonp())
+        commands.append(('cmd/{0}.jsonp'.format(tag), cmd, False))
 
     for tag, cmd in linux_config['rootcommands'].items():
-        df = JSONFile(cmd=cmd, sudo=True)
-        archive.writestr('cmd/{0}.jsonp'.format(tag), df.jsonp())
+        commands.append(('cmd/{0}.jsonp'.format(tag), cmd, True))
+
+    run_commands(archive, pool, commands)
 
     for file in linux_config['files']:
         df = JSONFile(path=file)
@@ -194,98 +324,117 @@ def linux_info(archive, args):
         logging.info('Collecting Linux SAR files')
 
         try:
-            out, err, rc = execute('rpm -q --quiet sysstat')
+            out, err, rc = execute('rpm -q --quiet sysstat', timeout=pool.command_timeout())
             if rc != 0:
                 logging.warning(Errors.W008)
 
-        except OSError:
+        except (OSError, CommandTimeout):
             pass
 
         if os.path.isfile('/usr/bin/systemctl'):
-            out, err, rc = execute('systemctl is-active --quiet sysstat-collect.timer')
-            if rc != 0:
+            out, err, rc = inline_command(pool, 'systemctl is-active --quiet sysstat-collect.timer')
+            if rc not in (0, None):
                 logging.warning(Errors.W009)                    
 
         sarinfo = JSONFile()
         sardirs = ('/var/log/sa', '/var/log/sysstat')
         sarinfo.dir(*sardirs)
         archive.writestr('sarinfo.json', sarinfo.dump())
+        sarfiles = []
         for sardir in sardirs:
             for sarfile in listdir(sardir):
                 path = os.path.join(sardir, sarfile)
                 if sarfile.startswith('sa'):
                     if sarfile.startswith('sar'):
                         continue
-                    archive.store(path)
-
-def aix_info(archive, args):
+                    if in_window(path, args):
+                        sarfiles.append(path)
+        if args.sar_format in ('binary', 'both'):
+            for path in sarfiles:
+                archive.store(path)
+        if args.sar_format in ('csv', 'both'):
+            sadf_info(archive, pool, sarfiles)
+
+def sadf_info(archive, pool, sarfiles):
+    """
+    Convert Linux SAR files to CSV (sadf -d) concurrently, so no version matched sadf is needed later
+    The conversion time and CSV size per file are in the header of each entry
+    """
+    logging.info('Converting %s SAR files to CSV', len(sarfiles))
+    for path in sarfiles:
+        tag = 'sar/{0}_csv.jsonp'.format(os.path.basename(path))
+        pool.submit(tag, JSONFile, cmd='sadf -d {0} -- -A'.format(path), sarfile=path)
+    elapsed = 0
+    for tag, df in pool.results():
+        if df is None:
+            continue
+        if df.info.get('status') == 'OK':
+            df.info['format'] = 'csv'
+            elapsed += df.info['elapsed']
+            logging.debug('%s: converted in %s seconds, %s bytes', df.info['sarfile'], df.info['elapsed'], df.info['size'])
+        df.write(archive, tag)
+    logging.info('SAR CSV conversion completed, total %.1f seconds', elapsed)
+
+def aix_info(archive, args, pool):
     """System/SAR info for AIX (pSeries)"""
     logging.info('Collecting AIX System info')
 
-    for tag, cmd in aix_config['commands'].items():
-        df = JSONFile(cmd=cmd)
-        archive.writestr('cmd/{0}.jsonp'.format(tag), df.jsonp())
+    commands = [('cmd/{0}.jsonp'.format(tag), cmd, False) for tag, cmd in aix_config['commands'].items()]
+    run_commands(archive, pool, commands)
 
     for file in aix_config['files']:
         df = JSONFile(path=file)
         archive.writestr(file + '.jsonp', df.jsonp())
 
-    disks, _, _ = execute('lsdev -Cc disk -Fname')
-    nics, _, _ = execute('ifconfig -l')
-    vgs, _, _ =  execute('lsvg')
+    disks, _, _ = inline_command(pool, 'lsdev -Cc disk -Fname')
+    nics, _, _ = inline_command(pool, 'ifconfig -l')
+    vgs, _, _ =  inline_command(pool, 'lsvg')
 
     logging.info('Collecting AIX Disk info')
+    commands = []
     for disk in disks.splitlines():
-        df_size = JSONFile(cmd='getconf DISK_SIZE /dev/{0}'.format(disk))
-        df_cfg  = JSONFile(cmd='lscfg -vpl {0}'.format(disk))
-        df_path = JSONFile(cmd='lspath -l {0} -F parent,status'.format(disk))
-        df_attr = JSONFile(cmd='lsattr -El {0}'.format(disk))
-        archive.writestr('disk/{0}_disksize.jsonp'.format(disk), df_size.jsonp())
-        archive.writestr('disk/{0}_lscfg.jsonp'.format(disk), df_cfg.jsonp())
-        archive.writestr('disk/{0}_lspath.jsonp'.format(disk), df_path.jsonp())
-        archive.writestr('disk/{0}_lsattr.jsonp'.format(disk), df_attr.jsonp())
+        commands.append(('disk/{0}_disksize.jsonp'.format(disk), 'getconf DISK_SIZE /dev/{0}'.format(disk), False))
+        commands.append(('disk/{0}_lscfg.jsonp'.format(disk), 'lscfg -vpl {0}'.format(disk), False))
+        commands.append(('disk/{0}_lspath.jsonp'.format(disk), 'lspath -l {0} -F parent,status'.format(disk), False))
+        commands.append(('disk/{0}_lsattr.jsonp'.format(disk), 'lsattr -El {0}'.format(disk), False))
+    run_commands(archive, pool, commands)
 
     logging.info('Collecting AIX Network info')
+    commands = []
     for nic in nics.split():
         if nic.startswith('lo'):
             continue
-        df_attr = JSONFile(cmd='lsattr -E -l {0} -F description,value'.format(nic))
-        df_stat = JSONFile(cmd='entstat -d {0}'.format(nic))
-        archive.writestr('nic/{0}_lsattr.jsonp'.format(nic), df_attr.jsonp())
-        archive.writestr('nic/{0}_entstat.jsonp'.format(nic), df_stat.jsonp())
+        commands.append(('nic/{0}_lsattr.jsonp'.format(nic), 'lsattr -E -l {0} -F description,value'.format(nic), False))
+        commands.append(('nic/{0}_entstat.jsonp'.format(nic), 'entstat -d {0}'.format(nic), False))
+    run_commands(archive, pool, commands)
 
     logging.info('Collecting AIX LVM info')
+    commands = []
     for vg in vgs.splitlines():
-        df_lvs =  JSONFile(cmd='lsvg -l {0}'.format(vg))
-        df_pvs =  JSONFile(cmd='lsvg -p {0}'.format(vg))
-        archive.writestr('lvm/{0}_lvs.jsonp'.format(vg), df_lvs.jsonp())
-        archive.writestr('lvm/{0}_pvs.jsonp'.format(vg), df_pvs.jsonp())
+        commands.append(('lvm/{0}_lvs.jsonp'.format(vg), 'lsvg -l {0}'.format(vg), False))
+        commands.append(('lvm/{0}_pvs.jsonp'.format(vg), 'lsvg -p {0}'.format(vg), False))
+    run_commands(archive, pool, commands)
 
-    sar_info(archive, args)
+    sar_info(archive, args, pool)
 
-def sun_info(archive, args):
+def sun_info(archive, args, pool):
     """System/SAR info for Sun Solaris (SPARC or Intel)"""
     logging.info('Collecting Solaris System info')
-    for tag, cmd in sunos_config['commands'].items():
-        df = JSONFile(cmd=cmd)
-        archive.writestr('cmd/{0}.jsonp'.format(tag), df.jsonp())
+    commands = [('cmd/{0}.jsonp'.format(tag), cmd, False) for tag, cmd in sunos_config['commands'].items()]
+    run_commands(archive, pool, commands)
 
     for file in sunos_config['files']:
         df = JSONFile(path=file)
         archive.writestr(file + '.jsonp', df.jsonp())
 
-    sar_info(archive, args)
+    sar_info(archive, args, pool)
 
-def hpux_info(archive, args):
+def hpux_info(archive, args, pool):
     """System/SAR info for HP-UX (Itanium)"""
     logging.info('Collecting HP-UX System info')
-    for tag, cmd in hpux_config['commands'].items():
-        df = JSONFile(cmd=cmd)
-        archive.writestr('cmd/{0}.jsonp'.format(tag), df.jsonp())
-
-    for tag, cmd in hpux_config['rootcommands'].items():
-        df = JSONFile(cmd=cmd, sudo=True)
-        archive.writestr('cmd/{0}.jsonp'.format(tag), df.jsonp())
+    commands = [('cmd/{0}.jsonp'.format(tag), cmd, False) for tag, cmd in hpux_config['commands'].items()]
+    commands += [('cmd/{0}.jsonp'.format(tag), cmd, True) for tag, cmd in hpux_config['rootcommands'].items()]
+    run_commands(archive, pool, commands)
 
     for file in hpux_config['files']:
         df = JSONFile(path=file)
@@ -293,17 +442,17 @@ def hpux_info(archive, args):
 
     logging.info('Collecting HP-UX Disk info')
     disks = []
-    ioscan, err, rc = execute('ioscan -funNC disk')
+    ioscan, err, rc = inline_command(pool, 'ioscan -funNC disk')
     for disk, rest in re.findall(r'^\s+(/dev/disk/\S+)\s+(.*)', ioscan, re.M):
         rdisks = rest.split()
         for disk in rdisks:
             if re.match(r'/dev/rdisk/disk\d+$', disk):
                 disks.append(disk)
 
+    commands = []
     for dev in disks:
         disk = os.path.basename(dev)
-        cmd = '/usr/sbin/diskinfo {0}'.format(dev)
-        diskinfo = JSONFile(cmd=cmd, sudo=True)
-        archive.writestr('cmd/diskinfo_{0}.jsonp'.format(disk), diskinfo.jsonp())
+        commands.append(('cmd/diskinfo_{0}.jsonp'.format(disk), '/usr/sbin/diskinfo {0}'.format(dev), True))
+    run_commands(archive, pool, commands)
 
-    sar_info(archive, args)
+    sar_info(archive, args, pool)
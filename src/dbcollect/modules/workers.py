@@ -4,100 +4,76 @@ Copyright (c) 2024 - Bart Sjerps <bart@dirty-cache.com>
 License: GPLv3+
 """
 
-import os, sys, re, time, logging
+import os, re, sys, time, logging
 
 from multiprocessing.queues import Full
 
 from lib.errors import Errors, SQLError, SQLTimeout
 from lib.functions import getscript
-from lib.config import dbinfo_config
+from lib.config import dbinfo_config, dbinfo_limits, dbinfo_database
 from lib.jsonfile import JSONFile
 from lib.log import exception_handler
+from lib.trace import Span, record
+from lib.profiler import profiled
+from lib.multiproc import TaskSlots
+
+def feedback_strip(path):
+    """
+    Remove the SQL*Plus feedback lines ('n rows selected.') from a spool file
+    Returns the highest number of rows of the queries in the file
+    """
+    maxrows = 0
+    try:
+        with open(path) as f:
+            lines = f.readlines()
+    except (IOError, OSError):
+        return maxrows
+    output = []
+    for line in lines:
+        r = re.match(r'^(\d+) rows? selected\.\s*$', line)
+        if r:
+            maxrows = max(maxrows, int(r.group(1)))
+            # SQL*Plus writes an empty line before the feedback
+            if output and not output[-1].strip():
+                output.pop()
+            continue
+        output.append(line)
+    with open(path, 'w') as f:
+        f.writelines(output)
+    return maxrows
 
 class Session():
-    """SQL*Plus worker session"""
+    """Worker session, runs queries via the instance backend"""
     def __init__(self, shared):
         self.tempdir  = shared.tempdir
         self.instance = shared.instance
         self.args     = shared.args
-        self.proc     = self.instance.sqlplus(quiet=True)
         self.sid      = self.instance.sid
         self.start    = time.time()
-        self.proc.stdin.write('WHENEVER SQLERROR EXIT SQL.SQLCODE\n')
-
-    def __del__(self):
-        """Send exit to SQLPlus if it is still running"""
-        if self.proc.returncode is None:
-            self.proc.communicate('exit;\n')
-
-    @property
-    def logfile(self):
-        return os.path.join(self.tempdir, 'log', "{0}_sqlplus_{1}.log".format(self.sid, self.proc.pid))
-
-    def send(self, s):
-        """Send command to SQLPlus and log to logfile"""
-        with open(self.logfile, 'a') as f:
-            f.write(s)
-        self.proc.stdin.write(s)
-
-    def run(self, name, query, filename=None, header=None):
-        """Run a query using SQLPlus"""
-
-        # Restart SQLPlus if needed
-        self.proc.poll()
-        if self.proc.returncode is not None:
-            logging.debug('rc={0}, Starting new SQLPlus process'.format(self.proc.returncode))
-            self.proc = self.instance.sqlplus(quiet=True)
-            self.proc.stdin.write('WHENEVER SQLERROR EXIT SQL.SQLCODE\n')
-
-        # Setup paths and record start time
-        spoolfile = os.path.join(self.tempdir, filename or 'out.txt')
-        statfile  = os.path.join(self.tempdir, '{0}_status'.format(self.proc.pid))
-        starttime = time.time()
-
-        # Send commands to SQLPlus
-        if header is not None:
-            self.send(header)
-        self.send('SPOOL {0}\n'.format(filename or 'out.txt'))
-        self.send(query)
-        self.send('\nSPOOL OFF\n')
-        self.send('HOST touch {0}\n'.format(statfile))
-
-        # Wait for the status file to appear and check for errors or timeouts
-        while not os.path.exists(statfile):
-            time.sleep(0.01)
-            self.proc.poll()
-
-            if self.proc.returncode is not None:
-                try:
-                    with open(spoolfile) as f:
-                        data = f.read()
-                except (OSError, IOError):
-                    data = ''
-
-                for err, msg in re.findall(r'^(ORA-\d+):(.*)', data, re.M):
-                    if err == 'ORA-00904':
-                        raise SQLError(Errors.E040, name, self.sid, err, msg)
-                    logging.debug('\n%s', data)
-
-                raise SQLError(Errors.E009, self.sid, self.proc.pid, self.proc.returncode, name)
-
-            elapsed = round(time.time() - starttime,2)
-            if elapsed > self.args.timeout * 60:
-                self.proc.kill()
-                raise SQLTimeout(Errors.E010, self.sid, self.proc.pid, round(elapsed), name)
-
-        elapsed = round(time.time() - starttime,2)
-        self.proc.poll()
-
-        # Remove status file if exists
-        try:
-            os.unlink(statfile)
-            status = 'OK'
-        except OSError:
-            status = 'ERROR'
-
-        return elapsed, self.proc.returncode, status, spoolfile
+        self.conn     = self.instance.backend.session(self.instance, self.tempdir, self.args)
+
+    def run(self, name, query, filename=None, header=None, timeout=None):
+        """Run a query, return elapsed time, returncode, status and the spool file"""
+        return self.conn.run(name, query, filename, header, timeout)
+
+    def limits(self, scriptname, header):
+        """
+        Apply the dbinfo_limits for a script: returns timeout (seconds), the script header and
+        the applied row limit (None if not limited). SQL*Plus settings persist in the session, so the
+        row limit is reset for other scripts (the header resets feedback).
+        With a row limit, feedback shows the number of rows per query to detect truncated output
+        """
+        limits  = dbinfo_limits.get(scriptname, {})
+        timeout = self.args.timeout * 60
+        rows    = None
+        if 'timeout' in limits:
+            timeout = min(timeout, limits['timeout'])
+        if self.conn.format == 'csv' or getattr(self.conn, 'rowlimit', False) or self.instance.release >= (18, 0):
+            rows    = limits.get('rows')
+            header += 'SET ROWLIMIT {0}\n'.format(rows or 'OFF')
+            if rows:
+                header += 'SET FEEDBACK 1\n'
+        return timeout, header, rows
 
     def genscripts(self):
         """ Generate the DBInfo scripts that need to be processed"""
@@ -115,53 +91,105 @@ class Session():
             for scriptname in dbinfo_config[section]:
                 yield scriptname
 
-    def dbinfo(self):
-        """ Run DBInfo scripts"""
+    def dbinfo(self, archive, dbscripts):
+        """
+        Run DBInfo scripts, results go straight to the archive as they complete
+        dbscripts maps database-scoped scripts that already ran (per database) to their archive entry
+        """
         logging.info('{0}: Running opatch lspatches'.format(self.sid))
         header = getscript('dbinfo/header.sql')
+        fmt    = self.conn.format
+
+        # CSV markup (--dbinfo-format csv) requires SQL*Plus 12.2 or higher, else fall back to text
+        if self.args.dbinfo_format == 'csv' and fmt == 'sqlplus':
+            if self.instance.release >= (12, 2):
+                header += 'SET MARKUP CSV ON QUOTE ON\n'
+                fmt = 'csv'
+            else:
+                logging.info('%s: CSV markup requires Oracle 12.2 or higher, using text format', self.sid)
 
         # Get ORACLE_HOME patch info
         lspatches_cmd  = '{0} lspatches'.format(os.path.join(self.instance.orahome, 'OPatch/opatch'))
         inventory_info = JSONFile()
-        inventory_info.execute(lspatches_cmd)
-        inventory_info.save(os.path.join(self.tempdir, 'dbinfo', '{0}_patches.jsonp'.format(self.sid)))
+        with Span('opatch', self.sid):
+            inventory_info.execute(lspatches_cmd)
+        inventory_info.write(archive, 'oracle/dbinfo/{0}_patches.jsonp'.format(self.sid))
 
         # Get Listener services
         listener_cmd  = '{0} status'.format(os.path.join(self.instance.orahome, 'bin/lsnrctl'))
         listener_info = JSONFile()
-        listener_info.execute(listener_cmd, ORACLE_HOME=self.instance.orahome)
-        listener_info.save(os.path.join(self.tempdir, 'dbinfo', '{0}_listener.jsonp'.format(self.sid)))
+        with Span('lsnrctl', self.sid):
+            listener_info.execute(listener_cmd, ORACLE_HOME=self.instance.orahome)
+        listener_info.write(archive, 'oracle/dbinfo/{0}_listener.jsonp'.format(self.sid))
+
+        # Database-scoped scripts run once per database. Standby databases share the DBID
+        # with the primary, and different users may see different data, so these are part of the key
+        meta  = self.instance.meta
+        dbkey = (meta.get('dbid'), meta.get('db_unique_name'), meta.get('dbuser'))
 
         logging.info('{0}: Running dbinfo scripts'.format(self.sid))
         for scriptname in self.genscripts():
-            logging.debug('{0}: Running dbinfo script {1}'.format(self.sid, scriptname))
-
             query    = getscript('dbinfo/{0}'.format(scriptname))
             filename = '{0}_{1}'.format(self.sid, scriptname.replace('.sql','.txt'))
             savename = '{0}_{1}'.format(self.sid, scriptname.replace('.sql','.jsonp'))
+            tag      = 'oracle/dbinfo/{0}'.format(savename)
+
+            if scriptname in dbinfo_database and (dbkey, scriptname) in dbscripts:
+                logging.debug('{0}: Skipping dbinfo script {1} (database-scoped, already collected)'.format(self.sid, scriptname))
+                jsonfile = JSONFile(status='REFERENCE', reference=dbscripts[(dbkey, scriptname)])
+                jsonfile.dbinfo(self.instance, scriptname, None)
+                jsonfile.write(archive, tag)
+                continue
+
+            logging.debug('{0}: Running dbinfo script {1}'.format(self.sid, scriptname))
 
             # Run the script and record the results
+            timeout, scripthdr, rows = self.limits(scriptname, header)
+            starttime = time.time()
             try:
-                elapsed, rc, status, outfile = self.run(scriptname, query, filename=filename, header=header)
+                elapsed, rc, status, outfile = self.run(scriptname, query, filename=filename, header=scripthdr, timeout=timeout)
+                truncated = None
+                if rows:
+                    truncated = feedback_strip(outfile) >= rows
+                    if truncated:
+                        logging.warning(Errors.W024, self.sid, scriptname, rows)
+                size = os.path.getsize(outfile) if os.path.isfile(outfile) else None
+                record('dbinfo', starttime, elapsed, self.sid, scriptname, size, status)
                 # Create JSONPlus file
                 jsonfile = JSONFile(elapsed=elapsed, status=status, returncode=rc)
-                jsonfile.dbinfo(self.instance, scriptname, outfile)
-                jsonfile.save(os.path.join(self.tempdir, 'dbinfo', savename))
+                jsonfile.dbinfo(self.instance, scriptname, outfile, fmt)
+                if rows:
+                    jsonfile.set('rows', rows)
+                    jsonfile.set('truncated', truncated)
+                jsonfile.write(archive, tag)
+                if scriptname in dbinfo_database and status == 'OK':
+                    dbscripts[(dbkey, scriptname)] = tag
 
             except SQLTimeout as e:
+                # The script was cancelled, record it with the partial output (if any)
+                record('dbinfo', starttime, time.time() - starttime, self.sid, scriptname, status='TIMEOUT')
                 logging.error(*e.args)
+                if rows:
+                    feedback_strip(os.path.join(self.tempdir, filename))
+                jsonfile = JSONFile()
+                jsonfile.dbinfo(self.instance, scriptname, os.path.join(self.tempdir, filename), fmt)
+                jsonfile.set('status', 'TIMEOUT')
+                jsonfile.set('timeout', timeout)
+                jsonfile.errors = 'Cancelled after {0} seconds'.format(timeout)
+                jsonfile.write(archive, tag)
 
             except SQLError as e:
+                record('dbinfo', starttime, time.time() - starttime, self.sid, scriptname, status='ERROR')
                 logging.error(*e.args)
 
     @property
     def runtime(self):
         return round(time.time() - self.start, 2)
 
-def info_processor(shared):
-    """info processor - Runs the dbinfo scripts"""
+def info_processor(shared, archive, dbscripts):
+    """info processor - Runs the dbinfo scripts (in a thread, concurrent with the AWR workers)"""
     session = Session(shared)
-    session.dbinfo()
+    session.dbinfo(archive, dbscripts)
 
     logging.info('%s: DBInfo processor finished, elapsed time %s seconds', shared.instance.sid, session.runtime)
 
@@ -183,9 +211,11 @@ def job_generator(shared):
         shared.done.set()
 
 @exception_handler
+@profiled
 def job_processor(shared, n):
     """Worker process that handles SQL*Plus subprocesses"""
     session  = Session(shared)
+    slots    = TaskSlots(shared.args.task_slots)
     name = 'Worker {0}'.format(n)
 
     while True:
@@ -194,14 +224,27 @@ def job_processor(shared, n):
             break
 
         # Get the next job and run it
-        job = shared.jobs.get(timeout=10)
+        with Span('queue_wait', session.sid) as span:
+            job = shared.jobs.get(timeout=10)
+        with shared.queue_wait.get_lock():
+            shared.queue_wait.value += time.time() - span.start
+
+        # With --multi-user, wait for a free slot in the host-wide task budget
+        if slots.path:
+            with Span('slot_wait', session.sid):
+                slots.acquire()
 
+        starttime = time.time()
         try:
             elapsed, rc, status, spoolfile = session.run(name, job.query, job.filename)
         except (SQLError, SQLTimeout) as e:
+            record('report', starttime, time.time() - starttime, session.sid, job.filename, status=type(e).__name__)
             logging.error(*e.args)
             break
-        
+        finally:
+            slots.release()
+
         # Move the completed AWR/SP file to the awr dir
         tgtfile = os.path.join(shared.tempdir, 'awr', job.filename)
+        record('report', starttime, elapsed, session.sid, job.filename, os.path.getsize(spoolfile), status)
         os.rename(spoolfile, tgtfile)
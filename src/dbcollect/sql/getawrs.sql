@@ -8,6 +8,11 @@
 --               inc_rac:  include snaps for other instances (RAC)
 --               inc_stby: include snaps for other DBIDs (realime standby DBs)
 --               inc_pack: include snaps for which diag/tuning packs are disabled
+--               rac_part: only include this node's share of (dbid, inst_num) pairs:
+--                         its own instance, plus inactive instances and other DBIDs
+--                         spread over the active instances (v$active_instances)
+--               rac_sql:  '--' unless rac_part = 1, comments out the rac_part lines
+--                         so v$active_instances is only used with rac_part = 1
 -- Output      : AWR snapshot parameters in CSV format
 -- ----------------------------------------------------------------------------
 
@@ -17,6 +22,8 @@
 -- define inc_rac  = 1
 -- define inc_stby = 1
 -- define inc_pack = 0
+-- define rac_part = 0
+-- define rac_sql  = "--"
 
 SET tab off feedback off verify off heading off lines 1000 pages 0 trims on
 ALTER SESSION SET nls_timestamp_format='YYYYMMDD_HH24MI';
@@ -33,6 +40,12 @@ WITH INFO AS (
   , '&inc_pack' inc_pack
   FROM dual
 )
+&rac_sql , ACTIVE AS (
+&rac_sql   SELECT inst_number
+&rac_sql   , row_number() over (ORDER BY inst_number) - 1 idx
+&rac_sql   , count(*)     over ()                         cnt
+&rac_sql   FROM v$active_instances
+&rac_sql )
 SELECT dbid
   || ',' || inst_num
   || ',' || prev_id
@@ -61,5 +74,10 @@ WHERE prev_id IS NOT NULL                              -- ignore FIRST
   AND (inc_rac  = 1 OR inst_num = (SELECT instance_number FROM v$instance)) -- include other RAC nodes
   AND (inc_stby = 1 OR dbid = (SELECT dbid FROM v$database))                -- include standby snapshots
   AND (inc_pack = 1 OR snap_flag NOT IN (4,5))                              -- include when diag/tuning packs disabled
+  -- partition over active RAC nodes (rac_part = 1)
+&rac_sql   AND (inst_num = (SELECT instance_number FROM v$instance)
+&rac_sql     OR (inst_num NOT IN (SELECT inst_number FROM active)
+&rac_sql       AND mod(dbid + inst_num, (SELECT nvl(max(cnt), 1) FROM active))
+&rac_sql         = (SELECT nvl(max(idx), 0) FROM active WHERE inst_number = (SELECT instance_number FROM v$instance))))
 ORDER BY dbid, snap_id, inst_num
 /
@@ -0,0 +1,57 @@
+"""
+test_profiler.py - Tests for lib/profiler.py (--profile)
+Copyright (c) 2024 - Bart Sjerps <bart@dirty-cache.com>
+License: GPLv3+
+
+Run from the repository root: python -m pytest tests (or python -m unittest discover tests)
+"""
+
+import os, sys, unittest, multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'dbcollect'))
+
+from lib.profiler import profiled, profile_setup, profile_merge, profiledir
+
+@profiled
+def job_processor():
+    """Stand-in for the AWR worker process"""
+    return sum(range(10000))
+
+def forked_process(target):
+    """Worker processes are forked, as in modules/oracle.py"""
+    if hasattr(multiprocessing, 'get_context'):
+        return multiprocessing.get_context('fork').Process(target=target)
+    return multiprocessing.Process(target=target)
+
+class ProfilerTest(unittest.TestCase):
+    def tearDown(self):
+        result = profile_merge()
+        if result:
+            os.unlink(result[0])
+
+    def test_forked_worker_profile(self):
+        """A worker forked while the main profiler is active saves its own profile (Python 3.12+)"""
+        profile_setup()
+        proc = forked_process(job_processor)
+        proc.start()
+        proc.join()
+        self.assertEqual(proc.exitcode, 0)
+        files = os.listdir(profiledir['path'])
+        self.assertTrue([f for f in files if f.startswith('job_processor_')], files)
+
+    def test_merge(self):
+        """The merged statistics include the worker process"""
+        profile_setup()
+        proc = forked_process(job_processor)
+        proc.start()
+        proc.join()
+        path, summary = profile_merge()
+        try:
+            # main process and worker
+            self.assertTrue(summary.startswith('Profile statistics of 2 processes/threads'))
+            self.assertIn('job_processor', summary)
+        finally:
+            os.unlink(path)
+
+if __name__ == '__main__':
+    unittest.main()